@@ -0,0 +1,129 @@
+# Admission control for the chat endpoints.
+# Requests are shed before any work is done: first by a per-caller token
+# bucket (429), then by a cap on requests in flight in this process (503).
+# Part of the cap is reserved for conversations already in progress, so a
+# surge of new sign-ups can't lock out users half way through a guide.
+
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import metrics
+
+
+class TokenBuckets:
+    """One token bucket per key, refilled at `rate` per second up to `burst`.
+
+    Keys are kept in LRU order and capped at max_keys; an evicted key simply
+    starts again with a full bucket. A rate of 0 disables the limit.
+    """
+
+    def __init__(self, rate, burst, max_keys=100000, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._clock = clock
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        """Take a token for key: 0 if admitted, else seconds until one is available"""
+        if self.rate <= 0:
+            return 0
+        now = self._clock()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                tokens = self.burst
+            else:
+                tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            admitted = tokens >= 1
+            self._buckets[key] = (tokens - 1 if admitted else tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return 0 if admitted else (1 - tokens) / self.rate
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class ConcurrencyLimit:
+    """Cap on requests in flight, with `reserved` slots only priority requests may use"""
+
+    def __init__(self, max_in_flight, reserved=0):
+        self.max_in_flight = max_in_flight
+        self.reserved = min(reserved, max_in_flight)
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, priority=False):
+        limit = self.max_in_flight if priority else self.max_in_flight - self.reserved
+        with self._lock:
+            if self.in_flight >= limit:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+
+class Admission:
+    """Rate limits per route and caller plus the shared concurrency cap"""
+
+    def __init__(self, limits, max_in_flight=32, reserved=8, retry_after=1):
+        self.limits = limits  # route -> TokenBuckets
+        self.concurrency = ConcurrencyLimit(max_in_flight, reserved)
+        self.retry_after = retry_after
+
+    def enter(self, route, key, priority=False):
+        """Admit a request or refuse it.
+
+        Returns None if admitted, and leave() must then be called once the
+        request is done. Otherwise returns (status, Retry-After seconds).
+        """
+        wait = self.limits[route].take(key)
+        if wait:
+            metrics.count('admission_total', route=route, outcome='rate_limited')
+            return 429, max(1, math.ceil(wait))
+        if not self.concurrency.acquire(priority):
+            metrics.count('admission_total', route=route, outcome='overloaded')
+            return 503, self.retry_after
+        metrics.count('admission_total', route=route,
+                      outcome='admitted_priority' if priority else 'admitted')
+        return None
+
+    def leave(self):
+        self.concurrency.release()
+
+    def settings(self):
+        """Configured limits, for /metrics"""
+        settings = {
+            'max_in_flight': self.concurrency.max_in_flight,
+            'reserved_in_flight': self.concurrency.reserved,
+            'retry_after_seconds': self.retry_after,
+        }
+        for route, buckets in self.limits.items():
+            settings[f'{route}_rate_per_second'] = buckets.rate
+            settings[f'{route}_burst'] = buckets.burst
+        return settings
+
+
+def create_admission():
+    """Build admission control from the environment"""
+    max_keys = int(os.getenv("ADMISSION_MAX_KEYS", 100000))
+    return Admission(
+        {
+            # Web users without a session cookie yet are keyed by IP, so allow
+            # for several behind one NAT
+            'chat': TokenBuckets(float(os.getenv("CHAT_RATE", 5)), float(os.getenv("CHAT_BURST", 20)), max_keys),
+            'telex': TokenBuckets(float(os.getenv("TELEX_RATE", 2)), float(os.getenv("TELEX_BURST", 10)), max_keys),
+        },
+        max_in_flight=int(os.getenv("ADMISSION_MAX_IN_FLIGHT", 32)),
+        reserved=int(os.getenv("ADMISSION_RESERVED_IN_FLIGHT", 8)),
+        retry_after=int(os.getenv("ADMISSION_RETRY_AFTER", 1)),
+    )
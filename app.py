@@ -1,316 +1,491 @@
-from flask import Flask, render_template, request, jsonify, session
+from flask import Blueprint, Flask, current_app, render_template, request, jsonify, session
 from dotenv import load_dotenv
+from werkzeug.middleware.proxy_fix import ProxyFix
+import atexit
+import functools
+import hashlib
+import json
+import math
 import os
-from data import GUIDES
+import secrets
+import time
+import uuid
 
-# Load environment variables
+# Load environment variables before the modules below read their settings
+# from it at import time (metrics, logs, classifier)
 load_dotenv()
 
-app = Flask(__name__)
-app.secret_key = os.getenv("FLASK_SECRET_KEY", "inec-cvr-chatbot-secret-key-2024")
-
-# Services that require revalidation first
-SERVICES_REQUIRING_REVALIDATION = ['transfer', 'update', 'lost-pvc']
-
-@app.route("/")
+from admission import create_admission
+from assets import StaticAssets, asset_response, page_asset
+from delivery import DeliveryPipeline, parse_event
+from funnel import TELEX, WEB, create_funnel_log, session_hash
+from guide_loader import GuideSource
+from idempotency import ID_TTL, PAYLOAD_TTL, ReplyCache, request_key
+from llm import create_fallback
+from logs import log
+from metrics import metrics
+from session_store import MemorySessionStore
+from state import ConversationState
+from tasks import BatchRunner, SessionTaskRunner, create_callback_sender
+
+# Routes live on a blueprint so create_app() can build the Flask app; the
+# stores and pipelines below are per process and shared by every app
+web = Blueprint('web', __name__)
+
+# Fingerprinted, precompressed copies of static/, served from /assets
+static_assets = StaticAssets(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static'))
+home_page = None  # index.html rendered and compressed by preload() or the first request
+
+@web.app_context_processor
+def asset_helpers():
+    return {"asset_url": static_assets.url, "inline_css": static_assets.inline_css}
+
+# Conversation state for Telex A2A sessions, keyed by sessionId
+telex_sessions = MemorySessionStore(
+    max_sessions=int(os.getenv("TELEX_SESSION_MAX", 10000)),
+    ttl=int(os.getenv("TELEX_SESSION_TTL", 3600)),
+)
+
+# Writers that don't hold the session lock can still race; the loser re-runs
+# its message against the winner's state this many times
+TELEX_STATE_ATTEMPTS = 3
+
+# Replies already sent to Telex, so retried deliveries aren't handled twice
+telex_replies = ReplyCache(max_entries=int(os.getenv("TELEX_REPLY_CACHE_SIZE", 20000)))
+telex_reply_ttl = {
+    'id': float(os.getenv("TELEX_REPLY_CACHE_TTL", ID_TTL)),
+    'payload': float(os.getenv("TELEX_RETRY_WINDOW", PAYLOAD_TTL)),
+}
+
+# TELEX_A2A_MODE=async answers /telex/a2a with 202 and a task id, runs the
+# handler on a thread pool and pushes the reply to TELEX_CALLBACK_URL
+telex_async = os.getenv("TELEX_A2A_MODE", "sync") == "async"
+telex_callback_url = os.getenv("TELEX_CALLBACK_URL")
+if telex_async and not telex_callback_url:
+    raise RuntimeError("TELEX_A2A_MODE=async needs TELEX_CALLBACK_URL")
+telex_tasks = SessionTaskRunner(
+    max_workers=int(os.getenv("TELEX_TASK_WORKERS", 8)),
+    max_pending=int(os.getenv("TELEX_TASK_QUEUE", 1000)),
+)
+telex_callbacks = create_callback_sender()
+
+# /telex/a2a/batch: many sessions' messages in one request
+telex_batches = BatchRunner(max_workers=int(os.getenv("TELEX_BATCH_WORKERS", 8)))
+TELEX_BATCH_MAX = int(os.getenv("TELEX_BATCH_MAX", 1000))
+
+# Telex delivery webhooks, aggregated and flushed to SQLite in the background
+delivery_events = DeliveryPipeline(
+    os.getenv("DELIVERY_DB_PATH", "telex_delivery.db"),
+    max_queue=int(os.getenv("DELIVERY_QUEUE_SIZE", 50000)),
+    flush_interval=float(os.getenv("DELIVERY_FLUSH_INTERVAL", 5.0)),
+)
+atexit.register(delivery_events.flush)
+
+# Transition table, matchers and replies compiled from the guides. Set
+# GUIDES_PATH to load them from a JSON/YAML file that is reloaded on change.
+guides = GuideSource(
+    os.getenv("GUIDES_PATH"),
+    poll_interval=float(os.getenv("GUIDES_POLL_INTERVAL", 5.0)),
+)
+
+# Per-caller rate limits and the in-flight cap for /chat and /telex/a2a
+admission = create_admission()
+
+# Binary log of every transition for drop-off analysis (FUNNEL_LOG_DIR)
+funnel_log = create_funnel_log()
+
+# Optional LLM answers for off-script questions (LLM_FALLBACK=1)
+llm_fallback = create_fallback()
+off_script = llm_fallback.augment if llm_fallback else None
+
+metrics.gauge('log_records_total', lambda: {
+    (('outcome', key),): value for key, value in log.stats().items() if key != 'queued'
+}, kind='counter')
+metrics.gauge('telex_delivery_events_total', lambda: {
+    (('type', key),): value for key, value in delivery_events.totals.items()
+}, kind='counter')
+metrics.gauge('telex_delivery_pipeline_total', lambda: {
+    (('outcome', key),): value for key, value in delivery_events.stats().items() if key != 'queued'
+}, kind='counter')
+metrics.gauge('telex_sessions', lambda: {(): len(telex_sessions)})
+metrics.gauge('telex_session_events_total', lambda: {
+    (('event', key),): value
+    for key, value in telex_sessions.stats().items() if key in ('hits', 'misses', 'expired', 'evicted', 'conflicts')
+}, kind='counter')
+metrics.gauge('telex_reply_cache_entries', lambda: {(): len(telex_replies)})
+metrics.gauge('telex_tasks_pending', lambda: {(): telex_tasks.pending})
+metrics.gauge('telex_callbacks_queued', lambda: {(): telex_callbacks.queued()})
+if funnel_log is not None:
+    metrics.gauge('funnel_records_total', lambda: {(): funnel_log.written}, kind='counter')
+metrics.gauge('admission_in_flight', lambda: {(): admission.concurrency.in_flight})
+metrics.gauge('admission_limit', lambda: {
+    (('setting', key),): value for key, value in admission.settings().items()
+})
+
+@web.route("/")
 def home():
+    global home_page
     session.clear()
-    return render_template("index.html")
-
-def send_step(process, step_index):
-    """Send a specific step to the user"""
-    steps = GUIDES[process]['steps']
-    
-    if step_index < len(steps):
-        step = steps[step_index]
-        response = f"**Step {step['number']}:** {step['instruction']}"
-        
-        if 'question' in step:
-            response += f"\n\n{step['question']}"
-        
-        # Add navigation hints
-        nav_hints = []
-        if step_index > 0:
-            nav_hints.append("'back' for previous step")
-        if process != 'universal-signup':
-            nav_hints.append("'restart' for different service")
-        
-        if nav_hints:
-            response += f"\n\n💡 *You can type {', '.join(nav_hints)}*"
-            
-        return jsonify({"reply": response})
-    else:
-        return jsonify({"reply": "You've completed all steps! 🎉"})
-
-def handle_universal_signup(user_message, state):
-    """Handle the universal sign-up process that everyone must complete"""
-    process = 'universal-signup'
-    current_step = state['current_step']
-    steps = GUIDES[process]['steps']
-    
-    # Handle user responses during sign-up
-    if any(word in user_message for word in ['back', 'previous']):
-        if current_step > 0:
-            state['current_step'] = current_step - 1
-        return send_step(process, state['current_step'])
-    
-    if any(word in user_message for word in ['restart', 'start over']):
-        state['current_step'] = 0
-        return send_step(process, 0)
-    
-    # Check for completion confirmation
-    if any(word in user_message for word in ['yes', 'ready', 'done', 'ok', 'continue', 'completed']):
-        if current_step + 1 < len(steps):
-            state['current_step'] = current_step + 1
-            return send_step(process, current_step + 1)
-        else:
-            # Universal sign-up completed - move to service selection
-            state['current_process'] = 'service-selection'
-            state['current_step'] = 0
-            state['completed_processes'].append('universal-signup')
-            
-            service_menu = """
-🎉 **Great! You're now signed into the INEC CVR portal.**
-
-**Which service would you like to proceed with?**
-
-• **New Registration** - For first-time voters
-• **Transfer** - If you've moved to a new location  
-• **Update** - To correct your information
-• **Lost PVC** - To replace a missing/damaged card
-• **Revalidation** - To review your existing details
-
-Just tell me which service you need help with!"""
-            
-            return jsonify({"reply": service_menu})
-    
-    # If user needs help or says no, repeat current step
-    elif any(word in user_message for word in ['no', 'help', 'not sure', "can't", 'problem']):
-        current_step_data = steps[current_step]
-        clarification = f"No problem! Let me help you with this step:\n\n**Step {current_step_data['number']}:** {current_step_data['instruction']}"
-        if 'question' in current_step_data:
-            clarification += f"\n\n{current_step_data['question']}"
-        return jsonify({"reply": clarification})
-    
-    # Default: continue with current step
-    return send_step(process, current_step)
-
-def handle_service_selection(user_message, state):
-    """Handle service selection after universal sign-up"""
-    service_keywords = {
-        'new-registration': ['new', 'register', 'first time', 'never registered'],
-        'transfer': ['transfer', 'move', 'relocate', 'new address'],
-        'update': ['update', 'correct', 'change', 'wrong information'],
-        'lost-pvc': ['lost', 'missing', 'damaged', 'replace pvc'],
-        'revalidation': ['review', 'revalidate', 'check my details']
-    }
+    # Identifies this page load's conversation (rate limits, funnel log)
+    session['sid'] = secrets.token_urlsafe(8)
+    if home_page is None:
+        home_page = page_asset(render_template("index.html"))
+    # The page names the current asset hashes, so it must be revalidated
+    return asset_response(current_app.response_class, home_page, request, cache_control="no-cache")
+
+@web.route("/assets/<name>")
+def static_asset(name):
+    """Serve a fingerprinted asset; its content never changes under this URL"""
+    asset = static_assets.files.get(name)
+    if asset is None:
+        return jsonify({"status": "not found"}), 404
+    return asset_response(current_app.response_class, asset, request)
+
+def admission_controlled(route, key, priority, rejected_body, hold_streams=False):
+    """Shed the request before doing any work when the caller is over its
+    rate limit (429) or too many requests are in flight (503).
+
+    With hold_streams, a streamed response keeps its in-flight slot until
+    the server closes it, for bodies that do the request's work as they
+    are generated.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            rejected = admission.enter(route, key(), priority())
+            if rejected is not None:
+                status, retry_after = rejected
+                response = jsonify(rejected_body())
+                response.status_code = status
+                response.headers["Retry-After"] = str(retry_after)
+                return response
+            try:
+                response = current_app.make_response(view(*args, **kwargs))
+            except BaseException:
+                admission.leave()
+                raise
+            if hold_streams and response.is_streamed:
+                response.call_on_close(admission.leave)
+            else:
+                admission.leave()
+            return response
+        return wrapper
+    return decorator
+
+def telex_session_id():
+    data = request.get_json(silent=True)
+    session_id = data.get('sessionId', 'default-session') if isinstance(data, dict) else None
+    # Anything but a string is left for the view to reject
+    return session_id if isinstance(session_id, str) else 'default-session'
+
+BUSY_TEXT = "We're handling a lot of requests right now. Please try again in a moment."
+
+def web_caller():
+    """Rate limit key of a web caller: the id its page load put in the
+    session cookie, or its IP without one. Behind a reverse proxy, set
+    TRUSTED_PROXIES so the IP is the client's rather than the proxy's."""
+    sid = session.get('sid')
+    return f"sid:{sid}" if sid else f"ip:{request.remote_addr}"
+
+# A conversation with state in its cookie is already under way and gets the
+# reserved slots
+chat_admission = admission_controlled(
+    'chat',
+    key=web_caller,
+    priority=lambda: 'state' in session,
+    rejected_body=lambda: {"reply": BUSY_TEXT},
+)
+
+def reply_response(reply):
+    """Turn a pre-rendered reply into a JSON response without re-encoding it"""
+    return current_app.response_class(reply.body, mimetype="application/json")
+
+def load_web_state(flow):
+    """Read the conversation state from the /chat cookie"""
+    if 'state' in session:
+        state = guides.decode_state(session['state'], flow)
+        if state is not None:
+            return state
+    # Cookies written before the compact encoding still carry the old dict
+    return ConversationState.from_dict(session.pop('conversation_state', None))
+
+def save_web_state(flow, state):
+    session['state'] = flow.codec.encode(state)
+
+def state_from_client(flow, data):
+    """Build the state reported by the client-side step engine"""
+    if not isinstance(data, dict):
+        raise ValueError("state must be an object")
+    state = ConversationState.from_dict(data)
+    if (not isinstance(state.current_process, str) or not isinstance(state.current_step, int)
+            or not all(isinstance(p, str) for p in state.completed_processes)
+            or not isinstance(state.pending_service, (str, type(None)))):
+        raise ValueError("malformed conversation state")
+    # The client may be running an older bundle
+    flow.remap(state)
+    return state
+
+def web_funnel_session():
+    """Funnel log id of this web conversation"""
+    # Clients that never loaded the page have no id yet
+    if 'sid' not in session:
+        session['sid'] = secrets.token_urlsafe(8)
+    return session_hash(session['sid'])
+
+# Transitions the client-side engine reports per sync, at most
+MAX_CLIENT_TURNS = 100
+
+def record_client_turns(flow, turns):
+    """Log the transitions the client-side engine made on its own.
+
+    Each turn is [from process, from step, to process, to step, intent,
+    milliseconds ago]. Turns that don't fit these guides are skipped.
+    Returns how many were logged.
+    """
+    if not isinstance(turns, list):
+        return 0
+    session_id, now, recorded = web_funnel_session(), time.time(), 0
+    for turn in turns[:MAX_CLIENT_TURNS]:
+        try:
+            from_process, from_step, to_process, to_step, intent, age_ms = turn
+            # 1.0 finds the same table entry as 1 but can't be packed
+            if not isinstance(from_step, int) or not isinstance(to_step, int):
+                continue
+            matcher = flow.states[from_process, from_step][0]
+            if (to_process, to_step) not in flow.states:
+                continue
+            at = now - max(float(age_ms), 0.0) / 1000
+        except (TypeError, ValueError, KeyError):
+            continue
+        index = matcher.intents.index(intent) if intent in matcher.intents else -1
+        funnel_log.record(WEB, session_id, flow, from_process, from_step, index,
+                          ConversationState(to_process, to_step), 0, at=at)
+        recorded += 1
+    return recorded
+
+def handle_web_message(user_message, client_state=None, client_turns=None):
+    """Run a web chat message and return the Reply with the resulting state.
+
+    The state comes from the cookie, or from client_state when the client-side
+    engine hands over a message it couldn't handle locally, along with the
+    turns it handled since its last sync.
+    """
+    flow = guides.current()
     
-    # Identify selected service
-    selected_service = None
-    for service, keywords in service_keywords.items():
-        if any(keyword in user_message for keyword in keywords):
-            selected_service = service
-            break
+    if not user_message:
+        return flow.replies[None, None, 'empty'], None
     
-    if selected_service:
-        # Check if this service requires revalidation first
-        if (selected_service in SERVICES_REQUIRING_REVALIDATION and 
-            'revalidation' not in state.get('completed_processes', [])):
-            
-            state['pending_service'] = selected_service  # Store the intended service
-            state['current_process'] = 'revalidation'
-            state['current_step'] = 0
-            
-            revalidation_message = f"""
-🔍 **Important Notice**
-
-Before proceeding with **{GUIDES[selected_service]['title']}**, INEC requires you to first complete the **Voter Revalidation** process before making any changes.
-
-Let's start with revalidation first:"""
-            
-            return jsonify({"reply": revalidation_message})
-        else:
-            # No revalidation needed or already completed
-            state['current_process'] = selected_service
-            state['current_step'] = 0
-            return send_step(selected_service, 0)
+    # Initialize session if not exists
+    if client_state is not None:
+        conversation_state = state_from_client(flow, client_state)
     else:
-        # Show service menu again
-        return jsonify({"reply": """I'm not sure which service you need. Please choose one:
-
-• **New Registration** - For first-time voters
-• **Transfer** - If you've moved to a new location  
-• **Update** - To correct your information
-• **Lost PVC** - To replace a missing/damaged card
-• **Revalidation** - To review your existing details
-
-Which one would you like assistance with?"""})
-
-def handle_specific_service(user_message, state):
-    """Handle steps for specific services"""
-    process = state['current_process']
-    current_step = state['current_step']
-    steps = GUIDES[process]['steps']
-    
-    # Handle navigation
-    if any(word in user_message for word in ['back', 'previous']):
-        if current_step > 0:
-            state['current_step'] = current_step - 1
-        return send_step(process, state['current_step'])
-    
-    if any(word in user_message for word in ['restart', 'start over', 'different service']):
-        state['current_process'] = 'service-selection'
-        state['current_step'] = 0
-        if 'pending_service' in state:
-            del state['pending_service']
-        return jsonify({"reply": "Okay, let's choose a different service. What would you like help with?"})
+        conversation_state = load_web_state(flow)
     
-    # Check for completion confirmation
-    if any(word in user_message for word in ['yes', 'ready', 'done', 'ok', 'continue', 'completed']):
-        if current_step + 1 < len(steps):
-            state['current_step'] = current_step + 1
-            return send_step(process, current_step + 1)
-        else:
-            # Service completed
-            completion_text = f"""🎉 **Excellent! You've completed all steps for {GUIDES[process]['title']}**
-
-**Required Documents:**
-{chr(10).join(['• ' + doc for doc in GUIDES[process]['required_documents']])}
-
-**Important Note:**
-{GUIDES[process].get('completion_note', 'Your request has been submitted and will be processed by INEC.')}"""
-
-            # Check if there's a pending service after revalidation
-            if process == 'revalidation' and 'pending_service' in state:
-                pending_service = state['pending_service']
-                del state['pending_service']
-                state['completed_processes'].append('revalidation')
-                
-                # Automatically proceed to the pending service
-                state['current_process'] = pending_service
-                state['current_step'] = 0
-                
-                continuation_text = f"""
-
-🔄 **Now proceeding with your original request: {GUIDES[pending_service]['title']}**
-
-{completion_text}
-
-Let's continue with your {GUIDES[pending_service]['title'].lower()}:"""
-                return send_step(pending_service, 0)
-            else:
-                # Regular completion
-                completion_text += """
-
-Would you like to:
-• **Start over** with a new service
-• Get help with something **else**
-• **End** this conversation"""
-                
-                state['current_process'] = 'service-selection'
-                state['current_step'] = 0
-                state['completed_processes'].append(process)
-                return jsonify({"reply": completion_text})
+    record = None
+    if funnel_log is not None:
+        if client_turns is not None:
+            record_client_turns(flow, client_turns)
+        record = functools.partial(funnel_log.record, WEB, web_funnel_session())
     
-    # If user needs help, repeat current step
-    elif any(word in user_message for word in ['no', 'help', 'not sure', "can't"]):
-        current_step_data = steps[current_step]
-        clarification = f"Let me help with this step:\n\n**Step {current_step_data['number']}:** {current_step_data['instruction']}"
-        if 'question' in current_step_data:
-            clarification += f"\n\n{current_step_data['question']}"
-        return jsonify({"reply": clarification})
+    # Handle the conversation based on current state
+    response = flow.dispatch(conversation_state, user_message, off_script, record)
     
-    # Default: continue with current step
-    return send_step(process, current_step)
+    save_web_state(flow, conversation_state)
+    return response, conversation_state
 
-@app.route("/chat", methods=["POST"])
+@web.route("/chat", methods=["POST"])
+@metrics.timed('http_request_seconds', route='/chat')
+@chat_admission
 def chat():
     try:
-        user_message = request.json.get("message", "").strip().lower()
-        
-        if not user_message:
-            return jsonify({"reply": "Please type a message so I can help you with INEC CVR services."})
-        
-        # Initialize session if not exists
-        if 'conversation_state' not in session:
-            session['conversation_state'] = {
-                'current_process': 'universal-signup',
-                'current_step': 0,
-                'completed_processes': [],
-                'pending_service': None
-            }
-        
-        conversation_state = session['conversation_state']
-        
-        # Handle the conversation based on current state
-        if conversation_state['current_process'] == 'universal-signup':
-            response = handle_universal_signup(user_message, conversation_state)
-        elif conversation_state['current_process'] == 'service-selection':
-            response = handle_service_selection(user_message, conversation_state)
-        else:
-            response = handle_specific_service(user_message, conversation_state)
+        data = request.json
+        user_message = data.get("message", "").strip().lower()
+        if 'state' not in data:
+            return reply_response(handle_web_message(user_message)[0])
         
-        session['conversation_state'] = conversation_state
-        return response
+        # Message from the client-side engine: send the new state back
+        reply, state = handle_web_message(user_message, data['state'], data.get('turns'))
+        return jsonify({"reply": reply.text, "state": state.to_dict() if state else data['state']})
         
     except Exception as e:
-        print(f"Error in /chat: {e}")
+        log.log('chat_error', level='error', error=repr(e))
+        metrics.count('http_exceptions_total', route='/chat')
         return jsonify({"reply": "I apologize for the technical issue. Please refresh the page and try again."})
 
-@app.route("/reset", methods=["POST"])
+@web.route("/chat/sync", methods=["POST"])
+@metrics.timed('http_request_seconds', route='/chat/sync')
+def chat_sync():
+    """Store the state reached by the client-side step engine"""
+    try:
+        flow = guides.current()
+        data = request.get_json(force=True)
+        state = state_from_client(flow, data.get("state"))
+        if funnel_log is not None and not record_client_turns(flow, data.get("turns")):
+            # Without turns, log the jump from the last state the server saw
+            previous = load_web_state(flow)
+            if (previous.current_process, previous.current_step) != (state.current_process, state.current_step):
+                funnel_log.record(WEB, web_funnel_session(), flow, previous.current_process,
+                                  previous.current_step, -1, state, 0)
+        save_web_state(flow, state)
+        return "", 204
+    except Exception as e:
+        log.log('chat_sync_error', level='error', error=repr(e))
+        return jsonify({"status": "error"}), 400
+
+@web.route("/guides/bundle", methods=["GET"])
+def guide_bundle_manifest():
+    """Point the client at the current content-hashed guide bundle"""
+    version = guides.current().bundle.version
+    response = jsonify({"version": version, "url": f"/guides/bundle/{version}.json"})
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+@web.route("/guides/bundle/<version>.json", methods=["GET"])
+def guide_bundle(version):
+    """The guide bundle itself; its URL changes whenever its content does"""
+    bundle = guides.current().bundle
+    if version != bundle.version:
+        return jsonify({"status": "not found"}), 404
+    response = current_app.response_class(bundle.body, mimetype="application/json")
+    response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    response.headers["ETag"] = f'"{bundle.version}"'
+    return response
+
+@web.route("/reset", methods=["POST"])
+@metrics.timed('http_request_seconds', route='/reset')
 def reset_conversation():
     """Reset the conversation"""
     session.clear()
     return jsonify({"status": "success", "reply": "Conversation reset. How can I help you with INEC CVR services today?"})
 
-# if __name__ == "__main__":
-#     app.run(debug=True, port=5000)
-
-
-
-@app.route("/telex/a2a", methods=["POST"])
+def handle_telex_message(session_id, message_text, idempotency_key=None):
+    """Run a Telex message against the stored session and return the reply text.
+
+    idempotency_key is request_key()'s (kind, key), or None for a message
+    that can't be told apart from a retry and is always handled.
+    """
+    kind, key = idempotency_key or ('none', None)
+    # Concurrent messages for one session take turns, so none of them works
+    # from a state another is about to replace. The LLM is only asked once
+    # the lock is released, so a slow answer holds up nobody else.
+    off_script_calls = []
+    with telex_sessions.lock(session_id):
+        # Get session state for this Telex user
+        conversation_state = telex_sessions.get(session_id)
+        if kind == 'payload':
+            # Users repeat "yes" legitimately, so without a message id only a
+            # repeat of the message that produced the current state is a retry
+            payload_key = key
+            key = f"{payload_key}@{conversation_state.version if conversation_state else 0}"
+        
+        # A retried delivery gets the reply it was first given
+        cached = telex_replies.get(key) if key is not None else None
+        metrics.count('telex_requests_total', key=kind, outcome='duplicate' if cached else 'new')
+        if cached is not None:
+            reply_text, state = cached
+            if session_id not in telex_sessions:
+                # The session expired since: bring back where that reply left it
+                telex_sessions.put(session_id, ConversationState.from_dict(state))
+            return reply_text
+        
+        for attempt in range(TELEX_STATE_ATTEMPTS):
+            if attempt:
+                conversation_state = telex_sessions.get(session_id)
+            if conversation_state is None:
+                conversation_state = ConversationState()
+            
+            # Process the message with the same flow as /chat
+            del off_script_calls[:]
+            record = functools.partial(funnel_log.record, TELEX, session_hash(session_id)) if funnel_log else None
+            reply = guides.current().dispatch(
+                conversation_state, message_text,
+                defer_off_script(off_script_calls) if off_script else None, record,
+            )
+            
+            # Update session, unless someone else updated it since we read it
+            if telex_sessions.put(session_id, conversation_state):
+                if kind == 'payload':
+                    key = f"{payload_key}@{conversation_state.version}"
+                if key is not None:
+                    telex_replies.put(key, (reply.text, conversation_state.to_dict()), telex_reply_ttl[kind])
+                break
+        else:
+            raise RuntimeError(f"Conversation state of {session_id} kept changing")
+    
+    if off_script_calls:
+        augmented = off_script(*off_script_calls[0])
+        if augmented is not reply:
+            reply = augmented
+            if key is not None:
+                telex_replies.put(key, (reply.text, conversation_state.to_dict()), telex_reply_ttl[kind])
+    return reply.text
+
+def defer_off_script(calls):
+    """Flow fallback that only notes its arguments in calls, so the LLM can
+    be asked after the session lock is released"""
+    def fallback(guide, step_index, message, reply):
+        calls.append((guide, step_index, message, reply))
+        return reply
+    return fallback
+
+def submit_telex_task(session_id, message_text, idempotency_key):
+    """Queue a Telex message for the task pool and answer 202 with its task id"""
+    # Retried deliveries get the same task id as the original. Without a
+    # message id the key is the payload, which a user legitimately repeats,
+    # so those tasks get ids of their own.
+    kind, key = idempotency_key
+    task_id = hashlib.sha256(key.encode()).hexdigest()[:32] if kind == 'id' else uuid.uuid4().hex
+    
+    def run():
+        try:
+            reply_text = handle_telex_message(session_id, message_text, idempotency_key)
+            status = "completed"
+            metrics.count('telex_tasks_total', outcome='completed')
+        except Exception as e:
+            log.log('telex_task_error', level='error', task_id=task_id, error=repr(e))
+            metrics.count('telex_tasks_total', outcome='failed')
+            reply_text = "I apologize, I'm having trouble processing your request. Please try again in a moment."
+            status = "failed"
+        telex_callbacks.send(telex_callback_url, {
+            "taskId": task_id,
+            "status": status,
+            "reply": {"text": reply_text},
+            "sessionId": session_id,
+        })
+    
+    if not telex_tasks.submit(session_id, run):
+        metrics.count('telex_tasks_total', outcome='rejected')
+        response = jsonify({"status": "busy", "sessionId": session_id})
+        response.status_code = 503
+        response.headers["Retry-After"] = str(admission.retry_after)
+        return response
+    metrics.count('telex_tasks_total', outcome='accepted')
+    return jsonify({"taskId": task_id, "status": "accepted", "sessionId": session_id}), 202
+
+@web.route("/telex/a2a", methods=["POST"])
+@metrics.timed('http_request_seconds', route='/telex/a2a')
+# Sessions we already hold state for are mid-flow and get priority
+@admission_controlled(
+    'telex',
+    key=telex_session_id,
+    priority=lambda: telex_session_id() in telex_sessions,
+    rejected_body=lambda: {"reply": {"text": BUSY_TEXT}, "sessionId": telex_session_id()},
+)
 def telex_a2a():
     """A2A endpoint for Telex.im integration"""
     try:
         data = request.json
-        print("Telex A2A request received:", data)
+        log.log('telex_a2a_request', sample=True, payload=data)
         
         # Extract message from Telex
-        message_text = data.get('message', {}).get('text', '').strip()
+        message_text = data.get('message', {}).get('text', '').strip().lower()
         session_id = data.get('sessionId', 'default-session')
         
-        # Initialize session for Telex users
-        if 'telex_sessions' not in session:
-            session['telex_sessions'] = {}
+        idempotency_key = request_key(data, session_id)
+        if telex_async:
+            return submit_telex_task(session_id, message_text, idempotency_key)
         
-        if session_id not in session['telex_sessions']:
-            session['telex_sessions'][session_id] = {
-                'current_process': 'universal-signup',
-                'current_step': 0,
-                'completed_processes': [],
-                'awaiting_phone': False
-            }
-        
-        # Get session state for this Telex user
-        conversation_state = session['telex_sessions'][session_id]
-        
-        # Process the message using your existing logic
-        if conversation_state['current_process'] == 'universal-signup':
-            response = handle_universal_signup(message_text, conversation_state)
-        elif conversation_state['current_process'] == 'service-selection':
-            response = handle_service_selection(message_text, conversation_state)
-        else:
-            response = handle_specific_service(message_text, conversation_state)
-        
-        # Update session
-        session['telex_sessions'][session_id] = conversation_state
-        
-        # Extract the reply text from the response
-        if hasattr(response, 'json'):
-            reply_data = response.json
-            reply_text = reply_data.get('reply', 'Sorry, I encountered an error.')
-        else:
-            reply_text = response.get('reply', 'Sorry, I encountered an error.')
+        reply_text = handle_telex_message(session_id, message_text, idempotency_key)
         
         # Format response for Telex A2A
         telex_response = {
@@ -323,7 +498,8 @@ def telex_a2a():
         return jsonify(telex_response)
         
     except Exception as e:
-        print(f"Telex A2A error: {e}")
+        log.log('telex_a2a_error', level='error', error=repr(e))
+        metrics.count('http_exceptions_total', route='/telex/a2a')
         error_response = {
             "reply": {
                 "text": "I apologize, I'm having trouble processing your request. Please try again in a moment."
@@ -332,31 +508,183 @@ def telex_a2a():
         }
         return jsonify(error_response)
 
-@app.route("/telex/webhook", methods=["POST"])
+def batch_request_keys(data, items):
+    """Idempotency keys for batch items, None for items that are always handled.
+
+    A backlog holds the same "yes" for one session many times over, in this
+    batch and the next, so content alone can't tell a retry from a new
+    message. Items are only deduplicated by their message id, or by their
+    position in a batch the relay named with a batchId.
+    """
+    batch_id = data.get('batchId') if isinstance(data, dict) else None
+    keys = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            keys.append(None)
+            continue
+        session_id = str(item.get('sessionId', 'default-session'))
+        kind, key = request_key(item, session_id)
+        if kind == 'id':
+            keys.append((kind, key))
+        elif isinstance(batch_id, str):
+            keys.append(('id', f"{session_id}:{batch_id}#{index}"))
+        else:
+            keys.append(None)
+    return keys
+
+def rate_limited_sessions(items):
+    """Take one telex token per session in the batch, as a single
+    /telex/a2a call would; returns {session id: Retry-After seconds} for
+    the sessions that are over their limit"""
+    refused = {}
+    for session_id in {batch_session_id(item) for item in items} - {None}:
+        wait = admission.limits['telex'].take(session_id)
+        if wait:
+            refused[session_id] = max(1, math.ceil(wait))
+    return refused
+
+def handle_batch_item(keys, refused, index, item):
+    """Run one batch item; a bad or failing item only fails its own result"""
+    if not isinstance(item, dict) or not isinstance(item.get('message'), dict) \
+            or not isinstance(item['message'].get('text', ''), str) \
+            or not isinstance(item.get('sessionId', 'default-session'), str):
+        metrics.count('telex_batch_items_total', outcome='invalid')
+        return {"index": index, "error": "item must be {sessionId, message: {text}}"}
+    
+    session_id = item.get('sessionId', 'default-session')
+    if session_id in refused:
+        # All or none of a session's items run, so its order holds
+        metrics.count('telex_batch_items_total', outcome='rate_limited')
+        return {"index": index, "sessionId": session_id, "error": "rate limited",
+                "retryAfter": refused[session_id]}
+    message_text = item['message'].get('text', '').strip().lower()
+    try:
+        reply_text = handle_telex_message(session_id, message_text, keys[index])
+    except Exception as e:
+        log.log('telex_batch_item_error', level='error', index=index, error=repr(e))
+        metrics.count('telex_batch_items_total', outcome='failed')
+        return {"index": index, "sessionId": session_id, "error": "internal error"}
+    metrics.count('telex_batch_items_total', outcome='ok')
+    return {"index": index, "sessionId": session_id, "reply": {"text": reply_text}}
+
+def batch_session_id(item):
+    session_id = item.get('sessionId', 'default-session') if isinstance(item, dict) else None
+    # Anything but a string is grouped under None and rejected by handle_batch_item
+    return session_id if isinstance(session_id, str) else None
+
+@web.route("/telex/a2a/batch", methods=["POST"])
+@metrics.timed('http_request_seconds', route='/telex/a2a/batch')
+@admission_controlled(
+    'telex',
+    key=lambda: request.remote_addr,
+    priority=lambda: False,
+    rejected_body=lambda: {"status": "busy"},
+    hold_streams=True,
+)
+def telex_a2a_batch():
+    """Handle many Telex A2A messages in one request.
+
+    Takes a list of {sessionId, message} items (bare or under "items",
+    next to an optional "batchId" that makes a retried batch idempotent).
+    Each session's messages run in order, sessions run in parallel. Results
+    carry the index of their item and come back as one JSON object, or as
+    NDJSON lines in completion order with ?stream=1 or
+    Accept: application/x-ndjson.
+    """
+    data = request.get_json(silent=True)
+    items = data.get('items') if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        return jsonify({"status": "error", "error": "expected a list of items"}), 400
+    if len(items) > TELEX_BATCH_MAX:
+        return jsonify({"status": "error", "error": f"at most {TELEX_BATCH_MAX} items per batch"}), 413
+    metrics.count('telex_batch_items_total', amount=len(items), outcome='received')
+    
+    handle = functools.partial(handle_batch_item, batch_request_keys(data, items), rate_limited_sessions(items))
+    results = telex_batches.run(items, batch_session_id, handle)
+    if request.args.get('stream') == '1' or request.accept_mimetypes.best == 'application/x-ndjson':
+        started = time.perf_counter()
+        lines = (json.dumps(result) + "\n" for result in results)
+        response = current_app.response_class(lines, mimetype="application/x-ndjson")
+        # http_request_seconds stops when the view returns, before any item ran
+        response.call_on_close(lambda: metrics.observe('telex_batch_stream_seconds', time.perf_counter() - started))
+        return response
+    return jsonify({"results": sorted(results, key=lambda result: result["index"])})
+
+@web.route("/telex/stats", methods=["GET"])
+def telex_stats():
+    """Usage counters for the Telex session store"""
+    return jsonify(telex_sessions.stats())
+
+@web.route("/telex/delivery", methods=["GET"])
+def telex_delivery():
+    """Stored delivery counts with failure and read rates"""
+    return jsonify(delivery_events.summary())
+
+@web.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Counters and latency histograms in Prometheus text format"""
+    return current_app.response_class(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@web.route("/telex/webhook", methods=["POST"])
+@metrics.timed('http_request_seconds', route='/telex/webhook')
 def telex_webhook():
     """Webhook for receiving Telex events (delivery status, etc.)"""
     try:
         data = request.json
-        print("Telex webhook event:", data)
         
         # Handle different webhook events
-        event_type = data.get('type')
+        try:
+            event = parse_event(data)
+        except ValueError as e:
+            return jsonify({"status": "error", "error": str(e)}), 400
+        log.log('telex_webhook_event', sample=True, type=data['type'], payload=data)
         
-        if event_type == 'message_delivered':
-            print("Message delivered successfully")
-        elif event_type == 'message_read':
-            print("Message was read by user")
-        elif event_type == 'message_failed':
-            print("Message failed to deliver")
+        # Delivery events are only queued here and stored in the background
+        if event is not None and not delivery_events.submit(*event):
+            return jsonify({"status": "busy"}), 503
         
         return jsonify({"status": "success"})
         
     except Exception as e:
-        print(f"Telex webhook error: {e}")
+        log.log('telex_webhook_error', level='error', error=repr(e))
+        metrics.count('http_exceptions_total', route='/telex/webhook')
         return jsonify({"status": "error"}), 500
-    
-
 
+def create_app(secret_key=None):
+    """Build the Flask app.
+
+    The secret key defaults to FLASK_SECRET_KEY. Without either a random key
+    is generated, which only works for a single process: cookies signed by
+    one worker would be rejected by the others.
+    """
+    app = Flask(__name__)
+    # Behind TRUSTED_PROXIES reverse proxies, take the client address from
+    # X-Forwarded-For so per-caller rate limits don't lump everyone together
+    trusted_proxies = int(os.getenv("TRUSTED_PROXIES", 0))
+    if trusted_proxies:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxies, x_proto=trusted_proxies)
+    app.secret_key = secret_key or os.getenv("FLASK_SECRET_KEY")
+    if not app.secret_key:
+        app.secret_key = secrets.token_hex(32)
+        log.log('secret_key_missing', level='warning',
+                detail="FLASK_SECRET_KEY is not set, using a random key for this process")
+    app.register_blueprint(web)
+    return app
+
+def preload(app):
+    """Build everything derived from the guides and static files up front.
+
+    A prefork server calls this in the master so the work is done once and
+    shared copy-on-write by every worker instead of repeated per worker.
+    """
+    global home_page
+    # The Flow with its bundle and classifier, and the static assets, are
+    # built on import; the page needs a request context to render
+    with app.test_request_context("/"):
+        home_page = page_asset(render_template("index.html"))
+    return app
+
+app = create_app()
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=int(os.getenv("PORT", 5000)))
\ No newline at end of file
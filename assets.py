@@ -0,0 +1,138 @@
+# Fingerprinted, precompressed static assets.
+# At startup every file in static/ is hashed, compressed once with gzip (and
+# brotli when the Brotli package is installed) and kept in memory. The page
+# links to /assets/<name>.<hash>.<ext>, which never changes content, so it is
+# served with immutable caching in whichever encoding the browser accepts.
+#
+#   python assets.py --build dist/   # write the same files for a CDN/nginx
+
+import argparse
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from collections import namedtuple
+
+from markupsafe import Markup
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# Smaller files than this are not worth compressing
+MIN_COMPRESS_SIZE = 256
+
+_CSS_COMMENT = re.compile(r"/\*.*?\*/", re.S)
+_CSS_SPACE = re.compile(r"\s*([{};:,>])\s*")
+
+# variants maps a Content-Encoding ('identity', 'gzip', 'br') to the bytes
+Asset = namedtuple('Asset', ['mimetype', 'etag', 'variants'])
+
+
+def compress(data):
+    """Return {encoding: bytes} for data, keeping only variants that are smaller"""
+    variants = {'identity': data}
+    if len(data) < MIN_COMPRESS_SIZE:
+        return variants
+    # mtime=0 keeps the gzip output identical between builds
+    candidates = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        candidates['br'] = brotli.compress(data, quality=11)
+    for encoding, compressed in candidates.items():
+        if len(compressed) < len(data):
+            variants[encoding] = compressed
+    return variants
+
+
+def minify_css(text):
+    """Strip comments and spacing from CSS that is inlined into the page"""
+    return _CSS_SPACE.sub(r"\1", _CSS_COMMENT.sub("", text)).strip()
+
+
+def fingerprint(name, data):
+    """script.js -> script.<hash>.js"""
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+
+
+def negotiate(variants, accept_encodings):
+    """Pick the smallest variant the client accepts: (encoding, body)"""
+    best = 'identity'
+    for encoding in ('br', 'gzip'):
+        if (encoding in variants and accept_encodings[encoding]
+                and len(variants[encoding]) < len(variants[best])):
+            best = encoding
+    return best, variants[best]
+
+
+def asset_response(response_class, asset, request, cache_control=IMMUTABLE):
+    """Serve asset in the best encoding for request, honouring If-None-Match"""
+    headers = {"Cache-Control": cache_control, "ETag": f'"{asset.etag}"', "Vary": "Accept-Encoding"}
+    if asset.etag in request.if_none_match:
+        return response_class(status=304, headers=headers)
+    encoding, body = negotiate(asset.variants, request.accept_encodings)
+    if encoding != 'identity':
+        headers["Content-Encoding"] = encoding
+    return response_class(body, mimetype=asset.mimetype, headers=headers)
+
+
+class StaticAssets:
+    """Fingerprinted copies of every file in a static directory"""
+
+    def __init__(self, static_dir, url_prefix="/assets", inline_limit=4096):
+        self.url_prefix = url_prefix
+        self.files = {}   # fingerprinted name -> Asset
+        self.urls = {}    # original name -> fingerprinted URL
+        self.inline = {}  # original name -> minified CSS small enough to inline
+        for name in sorted(os.listdir(static_dir)):
+            path = os.path.join(static_dir, name)
+            if not os.path.isfile(path):
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            hashed = fingerprint(name, data)
+            mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+            self.files[hashed] = Asset(mimetype, hashed, compress(data))
+            self.urls[name] = f"{url_prefix}/{hashed}"
+            if name.endswith('.css') and len(data) <= inline_limit:
+                self.inline[name] = minify_css(data.decode('utf-8'))
+
+    def url(self, name):
+        """Template helper: the fingerprinted URL of a static file"""
+        return self.urls[name]
+
+    def inline_css(self, name):
+        """Template helper: a <style> block for small CSS, else a <link>"""
+        if name in self.inline:
+            return Markup("<style>{}</style>").format(Markup(self.inline[name]))
+        return Markup('<link rel="stylesheet" href="{}">').format(self.urls[name])
+
+    def build(self, out_dir):
+        """Write every asset and its compressed variants to out_dir"""
+        os.makedirs(out_dir, exist_ok=True)
+        suffixes = {'identity': '', 'gzip': '.gz', 'br': '.br'}
+        for name, asset in self.files.items():
+            for encoding, data in asset.variants.items():
+                with open(os.path.join(out_dir, name + suffixes[encoding]), 'wb') as f:
+                    f.write(data)
+
+
+def page_asset(html):
+    """Precompress a rendered page; served with revalidation, not immutable"""
+    data = html.encode('utf-8')
+    return Asset('text/html', hashlib.sha256(data).hexdigest()[:16], compress(data))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write fingerprinted, precompressed static assets")
+    parser.add_argument('--static', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static'))
+    parser.add_argument('--build', metavar='DIR', required=True)
+    args = parser.parse_args()
+    assets = StaticAssets(args.static)
+    assets.build(args.build)
+    for name, url in assets.urls.items():
+        print(f"{name} -> {url}")
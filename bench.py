@@ -0,0 +1,293 @@
+# Load and latency benchmark for the chat endpoints.
+# Builds scripted conversations covering every path through GUIDES and
+# replays them concurrently against /chat and /telex/a2a, either in-process
+# through the Flask test client or over HTTP against a real WSGI server.
+#
+#   python bench.py --concurrency 16 --repeat 20 --save bench_baseline.json
+#   python bench.py --mode server --compare bench_baseline.json
+#   python bench.py --stress-session 200 --concurrency 32
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from data import GUIDES
+from flow import ENTRY_PROCESS, Flow, check_prerequisites
+from state import ConversationState
+
+
+def build_conversations(guides):
+    """Return {name: [messages]} covering every guide and navigation path"""
+    prerequisites = check_prerequisites(guides)
+    signup = ['hi'] + ['yes'] * len(guides[ENTRY_PROCESS]['steps'])
+    services = [process for process in guides if process != ENTRY_PROCESS]
+
+    def run_service(service, completed):
+        # Selecting a service detours through any prerequisite not done yet
+        messages = [guides[service]['keywords'][0]]
+        for prerequisite in prerequisites[service]:
+            if prerequisite not in completed:
+                messages += ['yes'] * len(guides[prerequisite]['steps'])
+                completed.add(prerequisite)
+        messages += ['yes'] * len(guides[service]['steps'])
+        completed.add(service)
+        return messages
+
+    conversations = {'signup-only': signup}
+    for service in services:
+        conversations[f'service:{service}'] = signup + run_service(service, {ENTRY_PROCESS})
+
+    # Every service back to back, so later ones skip the revalidation detour
+    completed = {ENTRY_PROCESS}
+    conversations['all-services'] = signup + [
+        message for service in services for message in run_service(service, completed)
+    ]
+
+    service = services[-1]
+    conversations['back-restart-loops'] = (
+        signup[:3] + ['back', 'back', 'yes', 'restart'] + signup[1:]
+        + [guides[service]['keywords'][0], 'yes', 'back', 'yes', 'restart'] * 3
+        + run_service(service, {ENTRY_PROCESS})
+    )
+    conversations['unrecognized'] = (
+        signup[:2] + ['what is this?', 'help', 'hmm'] + signup[2:]
+        + ['i need something', 'asdf'] + run_service(services[0], {ENTRY_PROCESS})
+        + ['no idea', 'help']
+    )
+    return conversations
+
+
+class TestClientTransport:
+    """Send turns in-process through the Flask test client"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def conversation(self):
+        return _TestClientConversation(self.app.test_client())
+
+
+class _TestClientConversation:
+    def __init__(self, client):
+        self.client = client
+
+    def post(self, path, payload):
+        cookie = self.client.get_cookie('session')
+        response = self.client.post(path, json=payload)
+        return response.status_code, response.get_data(), len(cookie.value) if cookie else 0
+
+    def close(self):
+        pass
+
+
+class ServerTransport:
+    """Send turns over HTTP to a threaded WSGI server on localhost"""
+
+    def __init__(self, app):
+        import httpx
+        from werkzeug.serving import WSGIRequestHandler, make_server
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_request(self, *args, **kwargs):
+                pass
+
+        self.httpx = httpx
+        self.server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+        self.base_url = f'http://127.0.0.1:{self.server.server_port}'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def conversation(self):
+        return _ServerConversation(self.httpx.Client(base_url=self.base_url, timeout=30))
+
+    def shutdown(self):
+        self.server.shutdown()
+
+
+class _ServerConversation:
+    def __init__(self, client):
+        self.client = client
+
+    def post(self, path, payload):
+        cookie = self.client.cookies.get('session')
+        response = self.client.post(path, json=payload)
+        return response.status_code, response.content, len(cookie) if cookie else 0
+
+    def close(self):
+        self.client.close()
+
+
+def replay(transport, endpoint, messages):
+    """Run one conversation and return a (latency, bytes, status) per turn"""
+    conversation = transport.conversation()
+    session_id = f'bench-{uuid.uuid4().hex}'
+    turns = []
+    try:
+        for n, message in enumerate(messages):
+            if endpoint == 'chat':
+                path, payload = '/chat', {'message': message}
+            else:
+                # Telex numbers its messages; without an id the second of two
+                # "yes" in a row would be taken for a retry of the first
+                path, payload = '/telex/a2a', {'sessionId': session_id,
+                                               'message': {'text': message, 'messageId': f'{session_id}-{n}'}}
+            request_bytes = len(json.dumps(payload))
+            started = time.perf_counter()
+            status, body, cookie_bytes = conversation.post(path, payload)
+            latency = time.perf_counter() - started
+            turns.append((latency, request_bytes + cookie_bytes, len(body), status))
+    finally:
+        conversation.close()
+    return turns
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(turns, elapsed):
+    latencies = sorted(turn[0] for turn in turns)
+    count = len(turns)
+    return {
+        'turns': count,
+        'errors': sum(1 for turn in turns if turn[3] != 200),
+        'throughput_rps': round(count / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'request_bytes_per_turn': round(sum(turn[1] for turn in turns) / count, 1) if count else 0.0,
+        'response_bytes_per_turn': round(sum(turn[2] for turn in turns) / count, 1) if count else 0.0,
+    }
+
+
+def run_benchmark(app, mode='client', endpoints=('chat', 'telex'), concurrency=8, repeat=10):
+    """Replay every scripted conversation `repeat` times per endpoint"""
+    conversations = build_conversations(GUIDES)
+    transport = ServerTransport(app) if mode == 'server' else TestClientTransport(app)
+    results = {'mode': mode, 'concurrency': concurrency, 'repeat': repeat, 'endpoints': {}}
+    try:
+        for endpoint in endpoints:
+            jobs = [messages for _ in range(repeat) for messages in conversations.values()]
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                runs = list(pool.map(lambda messages: replay(transport, endpoint, messages), jobs))
+            elapsed = time.perf_counter() - started
+            results['endpoints'][endpoint] = summarize([turn for run in runs for turn in run], elapsed)
+    finally:
+        if mode == 'server':
+            transport.shutdown()
+    return results
+
+
+def stress_session(app, mode='client', concurrency=32, messages=200):
+    """Send `messages` "yes" turns for one Telex session from many threads.
+
+    Whatever order they are handled in, linearizable updates give the same
+    replies as sending the admitted turns one after the other: every step
+    exactly once. A lost update shows up as a step replied twice.
+    """
+    transport = ServerTransport(app) if mode == 'server' else TestClientTransport(app)
+    session_id = f'stress-{uuid.uuid4().hex}'
+
+    def send(n):
+        conversation = transport.conversation()
+        try:
+            payload = {'sessionId': session_id, 'message': {'text': 'yes', 'messageId': f'{session_id}-{n}'}}
+            status, body, _ = conversation.post('/telex/a2a', payload)
+        finally:
+            conversation.close()
+        return json.loads(body)['reply']['text'] if status == 200 else None
+
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            replies = [reply for reply in pool.map(send, range(messages)) if reply is not None]
+        elapsed = time.perf_counter() - started
+    finally:
+        if mode == 'server':
+            transport.shutdown()
+
+    flow, state = Flow(GUIDES), ConversationState()
+    expected = Counter(flow.dispatch(state, 'yes').text for _ in replies)
+    received = Counter(replies)
+    return {
+        'messages': messages,
+        'admitted': len(replies),
+        'throughput_rps': round(messages / elapsed, 1),
+        'unexpected_replies': sum((received - expected).values()),
+        'linearizable': received == expected,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of regressions of results against a saved baseline"""
+    regressions = []
+    for endpoint, current in results['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(endpoint)
+        if not previous:
+            continue
+        for key in ('p50_ms', 'p95_ms', 'p99_ms', 'request_bytes_per_turn', 'response_bytes_per_turn'):
+            if previous[key] and current[key] > previous[key] * (1 + tolerance):
+                regressions.append(f"{endpoint} {key}: {previous[key]} -> {current[key]}")
+        if previous['throughput_rps'] and current['throughput_rps'] < previous['throughput_rps'] * (1 - tolerance):
+            regressions.append(
+                f"{endpoint} throughput_rps: {previous['throughput_rps']} -> {current['throughput_rps']}"
+            )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay scripted conversations against the chat endpoints")
+    parser.add_argument('--mode', choices=['client', 'server'], default='client',
+                        help="Flask test client (default) or a real WSGI server on localhost")
+    parser.add_argument('--endpoint', choices=['chat', 'telex', 'both'], default='both')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=10, help="times each conversation is replayed")
+    parser.add_argument('--save', metavar='PATH', help="write the results as a baseline JSON file")
+    parser.add_argument('--compare', metavar='PATH', help="compare against a saved baseline")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="allowed relative regression when comparing (default 0.2)")
+    parser.add_argument('--stress-session', type=int, metavar='N',
+                        help="instead: send N concurrent turns for one Telex session and "
+                             "check no update was lost")
+    args = parser.parse_args(argv)
+
+    # Every simulated user comes from 127.0.0.1: measure the handlers, not
+    # the per-caller rate limits (set CHAT_RATE/TELEX_RATE to include them)
+    os.environ.setdefault("CHAT_RATE", "0")
+    os.environ.setdefault("TELEX_RATE", "0")
+    from app import app
+
+    if args.stress_session:
+        results = stress_session(app, args.mode, args.concurrency, args.stress_session)
+        print(json.dumps(results, indent=2))
+        return 0 if results['linearizable'] else 1
+
+    endpoints = ('chat', 'telex') if args.endpoint == 'both' else (args.endpoint,)
+    results = run_benchmark(app, args.mode, endpoints, args.concurrency, args.repeat)
+    print(json.dumps(results, indent=2))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
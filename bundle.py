@@ -0,0 +1,48 @@
+# Guide bundle for the client-side step engine.
+# Everything the browser needs to run yes/back/help/restart and keyword
+# service selection locally: rendered replies, keyword tables and
+# prerequisites. It's served under a content-hashed URL so it can be cached
+# for good; messages the bundle can't handle still go to the server.
+
+import hashlib
+import json
+from collections import namedtuple
+
+from intents import SERVICE_STEP_INTENTS, SIGNUP_INTENTS
+
+# version is the content hash, body the serialized JSON
+Bundle = namedtuple('Bundle', ['version', 'body'])
+
+
+def build_bundle(flow, entry_process, selection):
+    guides = {}
+    for process, guide in flow.guides.items():
+        steps = range(len(guide['steps']))
+        guides[process] = {
+            'steps': [flow.replies[process, step, 'step'].text for step in steps],
+            'help': [flow.replies[process, step, 'help'].text for step in steps],
+            'prerequisites': flow.prerequisites[process],
+        }
+        if process != entry_process:
+            guides[process]['completion'] = flow.replies[process, None, 'completion'].text
+            guides[process]['notices'] = {
+                prerequisite: flow.replies[process, prerequisite, 'notice'].text
+                for prerequisite in flow.prerequisites[process]
+            }
+
+    content = {
+        'codec': flow.codec.version,
+        'entry': entry_process,
+        'selection': selection,
+        'guides': guides,
+        'intents': {'signup': SIGNUP_INTENTS, 'step': SERVICE_STEP_INTENTS},
+        'services': [
+            [service, flow.guides[service]['keywords']] for service in flow.service_matcher.intents
+        ],
+        'replies': {
+            'menu': flow.replies[selection, None, 'menu'].text,
+            'restart': flow.replies[selection, None, 'restart'].text,
+        },
+    }
+    body = json.dumps(content, separators=(',', ':')).encode()
+    return Bundle(hashlib.sha256(body).hexdigest()[:16], body)
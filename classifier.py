@@ -0,0 +1,188 @@
+# Local fallback classifier for free-text service requests.
+# When no service keyword matches, the message is scored against every
+# service with character n-gram TF-IDF vectors built from the guide text,
+# its keywords and the curated 'examples' phrases. Messages closer to a known
+# off-topic phrase, below the threshold, or without a clear lead over the
+# runner-up get the service menu instead: a wrong guess sends the user
+# through a whole guide (and maybe a detour) before they can restart.
+#
+#   python classifier.py --evaluate   # held-out accuracy and off-topic rejections
+
+import argparse
+import math
+import os
+import re
+from functools import lru_cache
+
+import numpy as np
+
+# Chosen with --evaluate, which scores every example and off-topic phrase
+# with that phrase held out of the matrix
+DEFAULT_THRESHOLD = float(os.getenv("CLASSIFIER_THRESHOLD", 0.5))
+DEFAULT_MARGIN = float(os.getenv("CLASSIFIER_MARGIN", 0.25))
+
+# Messages seen at service selection that aren't a request for any service
+OFF_TOPIC = [
+    "hello", "hi there", "good morning", "good evening", "how are you", "bye",
+    "thank you", "okay thanks", "who are you", "who made you", "what can you do",
+    "tell me a joke", "what time is it", "i need help", "please help me",
+    "i have a question", "i dont understand", "not sure", "nothing", "something else",
+    "different service", "another service", "start over", "continue",
+    "what do i do next", "what should i do now", "where do i go", "where is the office",
+    "how much does it cost", "is it free", "how long does it take", "what is the deadline",
+    "when is the election", "what is inec", "is this the real inec site",
+    "i want to talk to a person", "can you call me", "the website is not loading",
+    "my internet is slow", "can i do it on my phone",
+]
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+
+def ngrams(text, sizes=(3, 4, 5)):
+    """Character n-grams of each word, padded so word edges count"""
+    grams = []
+    for word in _NON_WORD.sub(' ', text.lower()).split():
+        padded = f" {word} "
+        for size in sizes:
+            grams.extend(padded[i:i + size] for i in range(max(len(padded) - size + 1, 1)))
+    return grams
+
+
+def service_texts(guide):
+    """Every phrase describing a guide, one matrix row each"""
+    texts = [guide['title'], guide.get('description', '')]
+    texts += [step['instruction'] for step in guide['steps']]
+    texts += guide.get('keywords', []) + guide.get('examples', [])
+    return [text for text in texts if text]
+
+
+class ServiceClassifier:
+    """Nearest-phrase service classifier over TF-IDF n-gram vectors.
+
+    Each phrase is an L2-normalized row of one matrix, grouped by service,
+    with the off-topic phrases as a last group. A message is scored against
+    every row with a single matrix-vector product and each group keeps its
+    best row score.
+    """
+
+    def __init__(self, services, threshold=DEFAULT_THRESHOLD, margin=DEFAULT_MARGIN,
+                 off_topic=OFF_TOPIC, cache_size=4096):
+        self.threshold = threshold
+        self.margin = margin
+        self.services = []
+        row_grams, starts = [], []
+        for service, guide in services.items():
+            self.services.append(service)
+            starts.append(len(row_grams))
+            row_grams += [ngrams(text) for text in service_texts(guide)]
+        self.off_topic_start = len(row_grams)
+        row_grams += [ngrams(text) for text in off_topic]
+
+        self.vocabulary = {}
+        document_frequency = []
+        for grams in row_grams:
+            for gram in set(grams):
+                index = self.vocabulary.setdefault(gram, len(self.vocabulary))
+                if index == len(document_frequency):
+                    document_frequency.append(0)
+                document_frequency[index] += 1
+        rows = len(row_grams)
+        self.idf = np.array(
+            [math.log((1 + rows) / (1 + df)) + 1 for df in document_frequency], dtype=np.float32
+        )
+
+        self.matrix = np.zeros((rows, len(self.vocabulary)), dtype=np.float32)
+        for row, grams in enumerate(row_grams):
+            for gram in grams:
+                self.matrix[row, self.vocabulary[gram]] += 1
+        self.matrix *= self.idf
+        norms = np.linalg.norm(self.matrix, axis=1, keepdims=True)
+        self.matrix /= np.where(norms == 0, 1, norms)
+        self.starts = np.array(starts)
+
+        # Repeated phrasings ("my card got burnt") skip the scoring entirely
+        self.classify = lru_cache(maxsize=cache_size)(self._classify)
+
+    def scores(self, message):
+        """Return the best cosine similarity of message for each service,
+        followed by its best similarity to an off-topic phrase"""
+        vector = np.zeros(len(self.vocabulary), dtype=np.float32)
+        for gram in ngrams(message):
+            index = self.vocabulary.get(gram)
+            if index is not None:
+                vector[index] += 1
+        vector *= self.idf
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return np.zeros(len(self.services) + 1, dtype=np.float32)
+        rows = self.matrix @ (vector / norm)
+        services = np.maximum.reduceat(rows[:self.off_topic_start], self.starts)
+        return np.append(services, rows[self.off_topic_start:].max(initial=0))
+
+    def _classify(self, message):
+        """Return (index into services, score) of the best service, with
+        index -1 if the message is off-topic, scores below the threshold or
+        doesn't lead the runner-up by the margin"""
+        scores = self.scores(message)
+        services, off_topic = scores[:-1], scores[-1]
+        ranked = np.argsort(services)[::-1]
+        best = int(ranked[0])
+        runner_up = services[ranked[1]] if len(ranked) > 1 else 0.0
+        if (services[best] < self.threshold or services[best] <= off_topic
+                or services[best] - runner_up < self.margin):
+            return -1, float(services[best])
+        return best, float(services[best])
+
+
+def evaluate(guides, threshold=DEFAULT_THRESHOLD, margin=DEFAULT_MARGIN, off_topic=OFF_TOPIC):
+    """Leave-one-out check of the classifier on the guides' examples and the
+    off-topic phrases.
+
+    The examples are part of the matrix and would always score 1.0, so each
+    phrase is classified by a classifier built without it. Returns a list of
+    (phrase, expected service or None, predicted service or None, score).
+    """
+    results = []
+    for service, guide in guides.items():
+        for index, example in enumerate(guide.get('examples', [])):
+            held_out = dict(guides, **{service: dict(guide, examples=[
+                other for i, other in enumerate(guide['examples']) if i != index
+            ])})
+            classifier = ServiceClassifier(held_out, threshold, margin, off_topic, cache_size=0)
+            predicted, score = classifier.classify(example.lower())
+            results.append((example, service, classifier.services[predicted] if predicted >= 0 else None, score))
+    for index, phrase in enumerate(off_topic):
+        others = off_topic[:index] + off_topic[index + 1:]
+        classifier = ServiceClassifier(guides, threshold, margin, others, cache_size=0)
+        predicted, score = classifier.classify(phrase)
+        results.append((phrase, None, classifier.services[predicted] if predicted >= 0 else None, score))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate the service classifier on held-out phrases")
+    parser.add_argument('--evaluate', action='store_true', required=True)
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument('--margin', type=float, default=DEFAULT_MARGIN)
+    args = parser.parse_args(argv)
+
+    from data import GUIDES
+    from flow import ENTRY_PROCESS
+    services = {service: guide for service, guide in GUIDES.items() if service != ENTRY_PROCESS}
+    results = evaluate(services, args.threshold, args.margin)
+
+    counts = {'correct': 0, 'wrong': 0, 'menu': 0, 'off-topic accepted': 0, 'off-topic rejected': 0}
+    for phrase, expected, predicted, score in results:
+        if expected is None:
+            outcome = 'off-topic accepted' if predicted else 'off-topic rejected'
+        else:
+            outcome = 'menu' if predicted is None else 'correct' if predicted == expected else 'wrong'
+        counts[outcome] += 1
+        print(f"{outcome:<18} {score:5.2f}  {expected or '-':<17} {predicted or '-':<17} {phrase}")
+    print()
+    print(f"threshold {args.threshold}, margin {args.margin}: "
+          + ", ".join(f"{outcome} {count}" for outcome, count in counts.items()))
+
+
+if __name__ == "__main__":
+    main()
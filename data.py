@@ -46,7 +46,11 @@ GUIDES = {
     # --- 1. NEW VOTER REGISTRATION ---
     "new-registration": {
         "title": "New Voter Pre-Registration Guide",
+        "short_title": "New Registration",
+        "summary": "For first-time voters",
         "description": "This is for citizens who have never registered before, between 2011 and 2022. Remember: Online Pre-Registration must be followed by physical Biometric Capture.",
+        "keywords": ["new", "register", "registration", "first time", "never registered"],
+        "examples": ["I want to get a voter card", "I have never voted before", "I just turned 18", "how do I become a voter", "I don't have a PVC yet", "get my first voters card"],
         "prerequisites": ["universal-signup"],
         "steps": [
             {
@@ -84,7 +88,11 @@ GUIDES = {
     # --- 2. TRANSFER OF POLLING UNIT ---
     "transfer": {
         "title": "Transfer of Polling Unit Guide",
+        "short_title": "Transfer",
+        "summary": "If you've moved to a new location",
         "description": "For already registered voters who have RELOCATED to a new area and need to change their Polling Unit to their new residence.",
+        "keywords": ["transfer", "move", "moved", "relocate", "relocated", "new address"],
+        "examples": ["I relocated to Abuja", "I changed my state of residence", "I want to vote in another state", "change my polling unit", "my polling unit is far from where I live now", "I have moved house"],
         "prerequisites": ["universal-signup", "revalidation"],
         "steps": [
             {
@@ -118,7 +126,11 @@ GUIDES = {
     # --- 3. VOTER INFORMATION UPDATE ---
     "update": {
         "title": "Voter Information Update Guide",
+        "short_title": "Update",
+        "summary": "To correct your information",
         "description": "For correcting errors like **misspelt names, date of birth, gender, or wrong address** on your existing voter record.",
+        "keywords": ["update", "correct", "change", "wrong information"],
+        "examples": ["my name is spelt wrongly", "my date of birth is wrong", "fix my details", "I got married and changed my surname", "edit my voter record", "there is a mistake on my card"],
         "prerequisites": ["universal-signup", "revalidation"],
         "steps": [
             {
@@ -153,7 +165,11 @@ GUIDES = {
     # --- 4. LOST OR DAMAGED PVC ---
     "lost-pvc": {
         "title": "Lost or Damaged PVC Replacement Guide",
+        "short_title": "Lost PVC",
+        "summary": "To replace a missing/damaged card",
         "description": "For requesting a replacement for a Permanent Voter's Card (PVC) that is missing or unusable.",
+        "keywords": ["lost", "missing", "damaged", "replace pvc"],
+        "examples": ["my card got burnt", "I can't find my voters card", "my PVC was stolen", "my card is torn", "I misplaced my PVC", "replace my voters card"],
         "prerequisites": ["universal-signup", "revalidation"],
         "steps": [
             {
@@ -187,7 +203,11 @@ GUIDES = {
     # --- 5. VOTER REVIEW / REVALIDATION ---
     "revalidation": {
         "title": "Voter Information Review/Revalidation Guide",
+        "short_title": "Voter Revalidation",
+        "summary": "To review your existing details",
         "description": "Required for all existing voters before making changes to their record. This verifies your identity and updates your voter information.",
+        "keywords": ["review", "revalidate", "revalidation", "check my details"],
+        "examples": ["confirm my registration", "verify my voter record", "is my registration still valid", "check if I am registered", "validate my voter details"],
         "prerequisites": ["universal-signup"],
         "steps": [
             {
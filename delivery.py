@@ -0,0 +1,167 @@
+# Ingestion of Telex delivery webhooks.
+# /telex/webhook only validates an event and queues it. A background thread
+# aggregates queued events into counts per (sessionId, event type) and
+# periodically upserts them into SQLite in one batch. flush() writes out
+# whatever is still aggregated, and runs at exit.
+
+import queue
+import sqlite3
+import threading
+import time
+
+from per_process import PerProcess
+
+DELIVERY_EVENTS = ('message_delivered', 'message_read', 'message_failed')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS delivery_counts (
+    session_id TEXT NOT NULL,
+    event_type TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    PRIMARY KEY (session_id, event_type)
+)
+"""
+
+UPSERT = """
+INSERT INTO delivery_counts (session_id, event_type, count, first_seen, last_seen)
+VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (session_id, event_type) DO UPDATE SET
+    count = count + excluded.count,
+    last_seen = excluded.last_seen
+"""
+
+
+def parse_event(data):
+    """Return (session_id, event_type) for a delivery event, or None if the
+    payload isn't one. Raises ValueError for malformed payloads."""
+    if not isinstance(data, dict) or not isinstance(data.get('type'), str):
+        raise ValueError("webhook event must be an object with a string 'type'")
+    if data['type'] not in DELIVERY_EVENTS:
+        return None
+    session_id = data.get('sessionId', 'unknown')
+    if not isinstance(session_id, str):
+        raise ValueError("'sessionId' must be a string")
+    return session_id, data['type']
+
+
+class DeliveryPipeline:
+    """Bounded queue of delivery events flushed to SQLite in batches"""
+
+    def __init__(self, db_path, max_queue=50000, flush_interval=5.0):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._worker = PerProcess(self._start_worker)
+        self.totals = dict.fromkeys(DELIVERY_EVENTS, 0)  # events accepted per type
+        self.dropped = 0
+        self.flushed_rows = 0
+        self.flush_errors = 0
+
+    def _start_worker(self):
+        worker = threading.Thread(target=self._run, name='delivery-flush', daemon=True)
+        worker.start()
+        return worker
+
+    def submit(self, session_id, event_type):
+        """Queue an event; returns False if the queue is full"""
+        self._worker.get()
+        try:
+            self._queue.put_nowait((session_id, event_type, time.time()))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.totals[event_type] += 1
+        return True
+
+    def _connect(self):
+        db = sqlite3.connect(self.db_path)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(SCHEMA)
+        return db
+
+    def _run(self):
+        db = self._connect()
+        while True:
+            deadline = time.monotonic() + self.flush_interval
+            pending = {}
+            # Aggregate everything that arrives until the next flush
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    event = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if event is None:
+                    # flush() is waiting: write out everything queued before it
+                    if pending:
+                        self._flush(db, pending)
+                        pending = {}
+                    self._queue.task_done()
+                    continue
+                session_id, event_type, seen = event
+                key = (session_id, event_type)
+                count, first_seen, _ = pending.get(key, (0, seen, seen))
+                pending[key] = (count + 1, first_seen, seen)
+                self._queue.task_done()
+            if pending:
+                self._flush(db, pending)
+
+    def _flush(self, db, pending):
+        rows = [
+            (session_id, event_type, count, first_seen, last_seen)
+            for (session_id, event_type), (count, first_seen, last_seen) in pending.items()
+        ]
+        try:
+            with db:
+                db.executemany(UPSERT, rows)
+            self.flushed_rows += len(rows)
+        except sqlite3.Error:
+            self.flush_errors += 1
+
+    def flush(self, timeout=2.0):
+        """Wait up to timeout seconds for queued and aggregated events to be
+        written to SQLite"""
+        if not self._worker.started():
+            return
+        deadline = time.monotonic() + timeout
+        try:
+            # Events are handled in order, so once this marker is done
+            # everything accepted before it is stored
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def summary(self):
+        """Return stored counts per event type with failure and read rates"""
+        db = self._connect()
+        try:
+            counts = dict(db.execute(
+                "SELECT event_type, SUM(count) FROM delivery_counts GROUP BY event_type"
+            ).fetchall())
+        finally:
+            db.close()
+        delivered = counts.get('message_delivered', 0)
+        sent = delivered + counts.get('message_failed', 0)
+        return {
+            "counts": counts,
+            "failure_rate": counts.get('message_failed', 0) / sent if sent else 0.0,
+            "read_rate": counts.get('message_read', 0) / delivered if delivered else 0.0,
+        }
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "dropped": self.dropped,
+            "flushed_rows": self.flushed_rows,
+            "flush_errors": self.flush_errors,
+        }
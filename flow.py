@@ -0,0 +1,224 @@
+# Conversation flow compiled from GUIDES.
+# Every (process, step) pair becomes a state with one row of transitions,
+# indexed by the intent the message matched. Both /chat and /telex/a2a run
+# messages through the same Flow.dispatch, so they can't drift apart.
+
+import time
+from collections import namedtuple
+from bundle import build_bundle
+from classifier import ServiceClassifier
+from intents import IntentMatcher, SIGNUP_INTENTS, SERVICE_STEP_INTENTS, build_service_matcher
+from replies import build_replies
+from metrics import metrics
+from state import StateCodec
+
+ENTRY_PROCESS = 'universal-signup'
+SELECTION = 'service-selection'
+
+# Metric labels for each kind of state, named after the handlers they replaced
+HANDLERS = {ENTRY_PROCESS: 'universal_signup', SELECTION: 'service_selection'}
+
+# Transition kinds
+GOTO = 0    # move to (process, step) and send reply
+FINISH = 1  # last step confirmed: mark the process completed and move on
+SELECT = 2  # start a service, detouring through missing prerequisites
+
+# reply is a key into the reply table; clear_pending drops the service
+# waiting on a prerequisite
+Transition = namedtuple('Transition', ['kind', 'process', 'step', 'reply', 'clear_pending'])
+
+
+def check_prerequisites(guides):
+    """Return {process: prerequisites in the order they must be completed}.
+
+    Raises ValueError if a guide names an unknown prerequisite or if the
+    prerequisites form a cycle.
+    """
+    if ENTRY_PROCESS not in guides:
+        raise ValueError(f"GUIDES must define the '{ENTRY_PROCESS}' guide")
+    for process, guide in guides.items():
+        for prerequisite in guide.get('prerequisites', []):
+            if prerequisite not in guides:
+                raise ValueError(f"Guide '{process}' has unknown prerequisite '{prerequisite}'")
+
+    ordered = {}
+
+    def visit(process, path):
+        if process in path:
+            cycle = ' -> '.join(path[path.index(process):] + [process])
+            raise ValueError(f"Prerequisite cycle in GUIDES: {cycle}")
+        if process not in ordered:
+            order = []
+            for prerequisite in guides[process].get('prerequisites', []):
+                for required in visit(prerequisite, path + [process]) + [prerequisite]:
+                    if required not in order:
+                        order.append(required)
+            ordered[process] = order
+        return ordered[process]
+
+    for process in guides:
+        visit(process, [])
+    return ordered
+
+
+class Flow:
+    """Transition table, intent matchers and replies built from one GUIDES"""
+
+    def __init__(self, guides):
+        self.guides = guides
+        self.prerequisites = check_prerequisites(guides)
+        self.replies = build_replies(guides, self.prerequisites)
+        self.codec = StateCodec(guides)
+
+        signup_matcher = IntentMatcher(SIGNUP_INTENTS)
+        step_matcher = IntentMatcher(SERVICE_STEP_INTENTS)
+        self.service_matcher = build_service_matcher(guides)
+        # Same service order as the matcher, so both index the same row
+        self.classifier = ServiceClassifier({
+            service: guides[service] for service in self.service_matcher.intents
+        })
+
+        # (process, step) -> (matcher, row). A row has one transition per
+        # matcher intent plus a trailing default for unmatched messages, so
+        # the matcher's -1 "no match" index picks the default.
+        self.states = {}
+        for process, guide in guides.items():
+            last_step = len(guide['steps']) - 1
+            if process == ENTRY_PROCESS:
+                matcher = signup_matcher
+                restart = Transition(GOTO, process, 0, (process, 0, 'step'), False)
+                finish = Transition(FINISH, SELECTION, 0, (SELECTION, None, 'menu'), False)
+            else:
+                matcher = step_matcher
+                restart = Transition(GOTO, SELECTION, 0, (SELECTION, None, 'restart'), True)
+                finish = Transition(FINISH, SELECTION, 0, (process, None, 'completion'), False)
+
+            for step in range(last_step + 1):
+                actions = {
+                    'back': Transition(GOTO, process, max(step - 1, 0), (process, max(step - 1, 0), 'step'), False),
+                    'restart': restart,
+                    'yes': finish if step == last_step else Transition(GOTO, process, step + 1, (process, step + 1, 'step'), False),
+                    'help': Transition(GOTO, process, step, (process, step, 'help'), False),
+                }
+                row = tuple(actions[intent] for intent in matcher.intents)
+                row += (Transition(GOTO, process, step, (process, step, 'step'), False),)
+                self.states[process, step] = (matcher, row)
+
+        row = tuple(Transition(SELECT, service, 0, None, False) for service in self.service_matcher.intents)
+        row += (Transition(GOTO, SELECTION, 0, (SELECTION, None, 'retry'), False),)
+        self.states[SELECTION, 0] = (self.service_matcher, row)
+
+        # Cacheable copy of the above for the client-side step engine
+        self.bundle = build_bundle(self, ENTRY_PROCESS, SELECTION)
+
+    def remap(self, state):
+        """Move a state built against other guides onto these guides.
+
+        Steps past the end of a shortened guide move to its last step, and a
+        user in a removed guide goes back to service selection (or the start
+        if they never finished sign-up).
+        """
+        state.completed_processes = [p for p in state.completed_processes if p in self.guides]
+        if state.pending_service not in self.guides:
+            state.pending_service = None
+        if state.current_process == SELECTION:
+            state.current_step = 0
+        elif state.current_process in self.guides:
+            last_step = len(self.guides[state.current_process]['steps']) - 1
+            state.current_step = min(max(state.current_step, 0), last_step)
+        elif ENTRY_PROCESS in state.completed_processes:
+            state.current_process = SELECTION
+            state.current_step = 0
+        else:
+            state.reset()
+
+    def missing_prerequisite(self, service, state):
+        """Return the first prerequisite of service the user hasn't completed"""
+        for prerequisite in self.prerequisites[service]:
+            if prerequisite not in state.completed_processes:
+                return prerequisite
+        return None
+
+    def dispatch(self, state, message, fallback=None, record=None):
+        """Apply a normalized message to state in place and return the Reply.
+
+        fallback(guide, step_index, message, reply) is called when a message
+        inside a guide matches no intent, and may return a different Reply.
+        record(flow, process, step, intent_index, state, seconds) is called
+        after every transition with the state it started from.
+        """
+        entry = self.states.get((state.current_process, state.current_step))
+        if entry is None or (state.pending_service is not None and state.pending_service not in self.guides):
+            # State from guides that have since been reloaded
+            self.remap(state)
+            entry = self.states[state.current_process, state.current_step]
+
+        handler = HANDLERS.get(state.current_process, 'specific_service')
+        sampled = metrics.sampled()
+        if record is None and not sampled:
+            return self._dispatch(entry, handler, state, message, fallback)[0]
+        process, step = state.current_process, state.current_step
+        started = time.perf_counter()
+        try:
+            reply, index = self._dispatch(entry, handler, state, message, fallback)
+        finally:
+            elapsed = time.perf_counter() - started
+            if sampled:
+                metrics.observe('chat_handler_seconds', elapsed, handler=handler)
+        if record is not None:
+            record(self, process, step, index, state, elapsed)
+        return reply
+
+    def _dispatch(self, entry, handler, state, message, fallback):
+        matcher, row = entry
+        index = matcher.match_index(message)
+        if index == -1 and matcher is self.service_matcher:
+            # No keyword: fall back to the free-text classifier
+            index, _ = self.classifier.classify(message)
+            metrics.count('chat_classifier_total', outcome='matched' if index >= 0 else 'unmatched')
+        metrics.count('chat_intents_total', handler=handler,
+                      intent=matcher.intents[index] if index >= 0 else 'none')
+        transition = row[index]
+
+        if transition.kind == SELECT:
+            service = transition.process
+            prerequisite = self.missing_prerequisite(service, state)
+            if prerequisite is not None:
+                state.pending_service = service
+                state.current_process = prerequisite
+                reply = self.replies[service, prerequisite, 'notice']
+            else:
+                state.current_process = service
+                reply = self.replies[service, 0, 'step']
+            state.current_step = 0
+
+        elif transition.kind == FINISH and state.pending_service:
+            # Continue with the service that was waiting on this one
+            self.mark_completed(state)
+            pending = state.pending_service
+            next_process = self.missing_prerequisite(pending, state) or pending
+            if next_process == pending:
+                state.pending_service = None
+            state.current_process = next_process
+            state.current_step = 0
+            reply = self.replies[next_process, 0, 'step']
+
+        else:
+            if transition.kind == FINISH:
+                self.mark_completed(state)
+            if transition.clear_pending:
+                state.pending_service = None
+            state.current_process = transition.process
+            state.current_step = transition.step
+            reply = self.replies[transition.reply]
+
+        if index == -1 and fallback is not None and state.current_process != SELECTION:
+            reply = fallback(self.guides[state.current_process], state.current_step, message, reply)
+
+        metrics.count('chat_step_transitions_total',
+                      process=state.current_process, step=state.current_step)
+        return reply, index
+
+    def mark_completed(self, state):
+        if state.current_process not in state.completed_processes:
+            state.completed_processes.append(state.current_process)
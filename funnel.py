@@ -0,0 +1,276 @@
+# Conversation funnel log.
+# Every transition is appended as one fixed-width binary record to a
+# preallocated, memory-mapped file, so recording a turn is a lock and a
+# struct.pack_into. Files rotate when full and each process writes its own.
+# The report command reads them back as numpy record arrays and computes
+# per-step funnels, drop-offs and dwell times.
+#
+#   FUNNEL_LOG_DIR=funnel python app.py
+#   python funnel.py report funnel/ [--guides guides.json] [--json]
+
+import argparse
+import glob
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+# Channels
+WEB = 0
+TELEX = 1
+CHANNELS = ('web', 'telex')
+
+NO_INTENT = 255
+
+# time, session hash, handler latency in microseconds, guide layout version
+# (StateCodec.version), channel, (process id, step) before and after the
+# message, matched intent or service index. Process ids are StateCodec ids.
+RECORD = struct.Struct('<dQIBBBBBBB5x')
+RECORD_FIELDS = [
+    ('ts', '<f8'), ('session', '<u8'), ('latency_us', '<u4'), ('version', 'u1'),
+    ('channel', 'u1'), ('from_process', 'u1'), ('from_step', 'u1'),
+    ('to_process', 'u1'), ('to_step', 'u1'), ('intent', 'u1'), ('_pad', 'V5'),
+]
+
+
+def session_hash(session_id):
+    """Stable 64-bit id for a session, the same in every worker"""
+    return int.from_bytes(hashlib.blake2b(session_id.encode(), digest_size=8).digest(), 'little')
+
+
+class FunnelLog:
+    """Append-only, memory-mapped, rotating log of conversation transitions"""
+
+    def __init__(self, directory, records_per_file=1 << 20):
+        self.directory = directory
+        self.records_per_file = records_per_file
+        self._lock = threading.Lock()
+        self._pid = None
+        self._file = None
+        self._map = None
+        self._offset = 0
+        self.written = 0
+        self.rotations = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _open(self):
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            if self._pid == os.getpid():
+                self.rotations += 1
+        path = os.path.join(self.directory, f"funnel-{time.time_ns()}-{os.getpid()}.bin")
+        self._file = open(path, 'w+b')
+        # Unwritten records stay zero and are skipped by the reader
+        self._file.truncate(self.records_per_file * RECORD.size)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        self._offset = 0
+        self._pid = os.getpid()
+
+    def record(self, channel, session, flow, process, step, intent, state, seconds, at=None):
+        """Flow.dispatch hook (bind channel and session_hash(...) first).
+
+        at is the transition's time, for transitions reported after the fact.
+        """
+        ids = flow.codec.process_ids
+        with self._lock:
+            if self._pid != os.getpid() or self._offset == len(self._map):
+                # A forked worker must not share its parent's file
+                self._open()
+            RECORD.pack_into(
+                self._map, self._offset, time.time() if at is None else at, session, min(int(seconds * 1e6), 0xffffffff),
+                flow.codec.version, channel, ids[process], step,
+                ids[state.current_process], state.current_step,
+                NO_INTENT if intent < 0 else intent,
+            )
+            self._offset += RECORD.size
+            self.written += 1
+
+    def close(self):
+        with self._lock:
+            if self._map is not None and self._pid == os.getpid():
+                self._map.flush()
+                self._map.close()
+                self._file.close()
+                self._map = None
+
+
+def create_funnel_log():
+    """Build the funnel log from the environment, or None unless FUNNEL_LOG_DIR is set"""
+    directory = os.getenv("FUNNEL_LOG_DIR")
+    if not directory:
+        return None
+    return FunnelLog(directory, int(os.getenv("FUNNEL_RECORDS_PER_FILE", 1 << 20)))
+
+
+def read_records(paths):
+    """Load funnel files into one numpy record array, skipping unused slots"""
+    import numpy as np
+
+    dtype = np.dtype(RECORD_FIELDS)
+    assert dtype.itemsize == RECORD.size
+    records = [np.fromfile(path, dtype=dtype) for path in sorted(paths)]
+    records = np.concatenate(records) if records else np.zeros(0, dtype=dtype)
+    return records[records['ts'] > 0]
+
+
+def _group_percentiles(keys, values, fractions):
+    """Per unique key, the given percentiles of values (nearest rank)"""
+    import numpy as np
+
+    order = np.lexsort((values, keys))
+    keys, values = keys[order], values[order]
+    unique, starts, counts = np.unique(keys, return_index=True, return_counts=True)
+    return unique, counts, [values[starts + ((counts - 1) * f).round().astype(int)] for f in fractions]
+
+
+def finish_intents(flow):
+    """Per process id, the intent index that finishes the guide from its
+    last step, or -1 for service selection and the entry guide"""
+    import numpy as np
+    from flow import ENTRY_PROCESS
+
+    intents = np.full(len(flow.codec.processes), -1, dtype=np.int64)
+    last_steps = np.zeros(len(flow.codec.processes), dtype=np.int64)
+    for process_id, process in enumerate(flow.codec.processes):
+        if process_id == 0 or process == ENTRY_PROCESS:
+            continue
+        last_steps[process_id] = len(flow.guides[process]['steps']) - 1
+        intents[process_id] = flow.states[process, last_steps[process_id]][0].intents.index('yes')
+    return intents, last_steps
+
+
+def funnel_report(records, flow):
+    """Per-step funnels, drop-offs and dwell times for one guide layout.
+
+    A session that ends back at service selection right after finishing a
+    service completed it rather than dropped off. Records written against
+    another layout can't be mapped to step names and are only counted.
+    """
+    import numpy as np
+
+    current = records[records['version'] == flow.codec.version]
+    report = {
+        'records': int(len(records)),
+        'other_layouts': int(len(records) - len(current)),
+        'sessions': int(len(np.unique(current['session']))),
+        'channels': {
+            CHANNELS[channel]: int(count)
+            for channel, count in zip(*np.unique(current['channel'], return_counts=True))
+            if channel < len(CHANNELS)
+        },
+        'median_latency_us': float(np.median(current['latency_us'])) if len(current) else 0.0,
+        'processes': {},
+        'completed': {},
+    }
+    if not len(current):
+        return report
+
+    # One key per (process, step) so everything below is a bincount
+    max_steps = 256
+    to_key = current['to_process'].astype(np.int64) * max_steps + current['to_step']
+    size = len(flow.codec.processes) * max_steps
+
+    # Distinct sessions that reached each step
+    order = np.lexsort((to_key, current['session']))
+    sessions, keys = current['session'][order], to_key[order]
+    first = np.append(True, (sessions[1:] != sessions[:-1]) | (keys[1:] != keys[:-1]))
+    reached = np.bincount(keys[first], minlength=size)
+
+    # Transitions that finished a service
+    intents, last_steps = finish_intents(flow)
+    from_process = current['from_process'].astype(np.int64)
+    known = from_process < len(intents)
+    from_process = np.where(known, from_process, 0)
+    finished = (known & (intents[from_process] >= 0) & (current['intent'] == intents[from_process])
+                & (current['from_step'] == last_steps[from_process]))
+
+    # Sessions that finished each service
+    order = np.lexsort((from_process[finished], current['session'][finished]))
+    sessions, processes = current['session'][finished][order], from_process[finished][order]
+    first = np.append(True, (sessions[1:] != sessions[:-1]) | (processes[1:] != processes[:-1]))[:len(sessions)]
+    completed = np.bincount(processes[first], minlength=len(intents))
+
+    # Where each session's last message left it, unless it finished a service
+    order = np.lexsort((current['ts'], current['session']))
+    sessions, keys, ts = current['session'][order], to_key[order], current['ts'][order]
+    last = np.append(sessions[1:] != sessions[:-1], True)
+    done = (finished & (current['to_process'] == 0))[order]
+    dropped = np.bincount(keys[last & ~done], minlength=size)
+
+    # Time spent at a step: until the same session's next message
+    same = sessions[1:] == sessions[:-1]
+    dwell_keys, dwell = keys[:-1][same], (ts[1:] - ts[:-1])[same]
+    dwell_stats = {}
+    if len(dwell):
+        unique, counts, (p50, p90) = _group_percentiles(dwell_keys, dwell, (0.5, 0.9))
+        dwell_stats = {int(k): (int(c), float(a), float(b)) for k, c, a, b in zip(unique, counts, p50, p90)}
+
+    for process_id, process in enumerate(flow.codec.processes):
+        steps = 1 if process_id == 0 else len(flow.guides[process]['steps'])
+        rows = []
+        for step in range(steps):
+            key = process_id * max_steps + step
+            samples, p50, p90 = dwell_stats.get(key, (0, None, None))
+            rows.append({
+                'step': step + 1,
+                'reached': int(reached[key]),
+                'dropped': int(dropped[key]),
+                'dwell_samples': samples,
+                'dwell_p50_s': p50,
+                'dwell_p90_s': p90,
+            })
+        report['processes'][process] = rows
+        if intents[process_id] >= 0:
+            report['completed'][process] = int(completed[process_id])
+    return report
+
+
+def print_report(report):
+    print(f"{report['records']} records, {report['sessions']} sessions, "
+          f"{report['other_layouts']} from other guide layouts, "
+          f"median handler latency {report['median_latency_us']:.0f} us")
+    print("channels: " + ", ".join(f"{name}={count}" for name, count in report['channels'].items()))
+
+    def seconds(value):
+        return '-' if value is None else f"{value:.1f}"
+
+    for process, rows in report['processes'].items():
+        print(f"\n{process}" + (f" (completed by {report['completed'][process]} sessions)"
+                                 if process in report['completed'] else ""))
+        print(f"  {'step':>4} {'reached':>8} {'dropped':>8} {'drop %':>7} {'dwell p50 s':>12} {'dwell p90 s':>12}")
+        for row in rows:
+            rate = 100 * row['dropped'] / row['reached'] if row['reached'] else 0.0
+            print(f"  {row['step']:>4} {row['reached']:>8} {row['dropped']:>8} {rate:>6.1f}% "
+                  f"{seconds(row['dwell_p50_s']):>12} {seconds(row['dwell_p90_s']):>12}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-step funnels and dwell times from funnel logs")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    report = subcommands.add_parser('report', help="aggregate funnel files")
+    report.add_argument('directory')
+    report.add_argument('--guides', metavar='PATH', help="guides file the logs were written with "
+                                                         "(default: data.GUIDES)")
+    report.add_argument('--json', action='store_true', help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    from flow import Flow
+    if args.guides:
+        from guide_loader import load_guides
+        guides = load_guides(args.guides)
+    else:
+        from data import GUIDES as guides
+
+    result = funnel_report(read_records(glob.glob(os.path.join(args.directory, 'funnel-*.bin'))), Flow(guides))
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
+
+
+if __name__ == "__main__":
+    main()
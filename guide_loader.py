@@ -0,0 +1,171 @@
+# Guide content loaded from an external JSON/YAML file, reloaded on change.
+# A new Flow is built off the request path when the file's mtime changes and
+# published with a single reference swap, so requests already running finish
+# against the Flow they started with.
+#
+#   python guide_loader.py --export guides.json   # start from data.GUIDES
+
+import argparse
+import json
+import os
+import threading
+import time
+
+from data import GUIDES
+from flow import ENTRY_PROCESS, Flow
+from logs import log
+from metrics import metrics
+from per_process import PerProcess
+from state import StateCodec
+
+# Optional string fields of a guide and of a step
+GUIDE_TEXT_FIELDS = ('short_title', 'summary', 'description', 'completion_note')
+GUIDE_LIST_FIELDS = ('keywords', 'examples', 'prerequisites', 'required_documents')
+
+
+def validate_guides(guides):
+    """Check guides against the GUIDES schema, raising ValueError on the first problem"""
+    if not isinstance(guides, dict) or not guides:
+        raise ValueError("guides must be a non-empty object keyed by process name")
+    if len(guides) > StateCodec.MAX_GUIDES:
+        raise ValueError(f"guides has more than {StateCodec.MAX_GUIDES} guides")
+
+    for process, guide in guides.items():
+        where = f"guides['{process}']"
+        if not isinstance(guide, dict):
+            raise ValueError(f"{where} must be an object")
+        if not isinstance(guide.get('title'), str):
+            raise ValueError(f"{where}['title'] must be a string")
+        for field in GUIDE_TEXT_FIELDS:
+            if field in guide and not isinstance(guide[field], str):
+                raise ValueError(f"{where}['{field}'] must be a string")
+        for field in GUIDE_LIST_FIELDS:
+            value = guide.get(field, [])
+            if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+                raise ValueError(f"{where}['{field}'] must be a list of strings")
+        if process != ENTRY_PROCESS and not guide.get('keywords'):
+            raise ValueError(f"{where}['keywords'] must list at least one keyword")
+
+        steps = guide.get('steps')
+        if not isinstance(steps, list) or not steps:
+            raise ValueError(f"{where}['steps'] must be a non-empty list")
+        if len(steps) > 255:
+            raise ValueError(f"{where}['steps'] has more than 255 steps")
+        for index, step in enumerate(steps):
+            step_where = f"{where}['steps'][{index}]"
+            if not isinstance(step, dict):
+                raise ValueError(f"{step_where} must be an object")
+            if not isinstance(step.get('number'), int):
+                raise ValueError(f"{step_where}['number'] must be an integer")
+            if not isinstance(step.get('instruction'), str):
+                raise ValueError(f"{step_where}['instruction'] must be a string")
+            if 'question' in step and not isinstance(step['question'], str):
+                raise ValueError(f"{step_where}['question'] must be a string")
+
+
+def load_guides(path):
+    """Read and validate guides from a .json, .yaml or .yml file"""
+    with open(path, encoding='utf-8') as f:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError("PyYAML is required to load YAML guides")
+            guides = yaml.safe_load(f)
+        else:
+            guides = json.load(f)
+    validate_guides(guides)
+    return guides
+
+
+class GuideSource:
+    """Holds the current Flow and rebuilds it when the guides file changes.
+
+    Without a path the Flow is built once from data.GUIDES. Codecs of the
+    last few Flows are kept so cookies written before a reload can still be
+    decoded and remapped onto the new guides.
+    """
+
+    def __init__(self, path=None, poll_interval=5.0, keep_codecs=8):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.keep_codecs = keep_codecs
+        self._poller = PerProcess(self._start_polling)
+        self._mtime = None
+        self._old_codecs = []
+        if path:
+            self._mtime = os.stat(path).st_mtime_ns
+            self.flow = Flow(load_guides(path))
+        else:
+            self.flow = Flow(GUIDES)
+
+    def current(self):
+        """Return the Flow to use for this request"""
+        if self.path:
+            self._poller.get()
+        return self.flow
+
+    def _start_polling(self):
+        poller = threading.Thread(target=self._poll, name='guide-reload', daemon=True)
+        poller.start()
+        return poller
+
+    def _poll(self):
+        while True:
+            time.sleep(self.poll_interval)
+            self.check()
+
+    def check(self):
+        """Reload the guides if the file changed; returns True on a reload"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError as e:
+            log.log('guides_reload_error', level='error', error=repr(e))
+            return False
+        if mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        try:
+            flow = Flow(load_guides(self.path))
+        except (OSError, ValueError) as e:
+            # Keep serving the previous guides until the file is fixed
+            metrics.count('guides_reloads_total', outcome='failed')
+            log.log('guides_reload_error', level='error', error=repr(e))
+            return False
+
+        if flow.codec.version != self.flow.codec.version:
+            self._old_codecs = ([self.flow.codec] + self._old_codecs)[:self.keep_codecs]
+        self.flow = flow
+        metrics.count('guides_reloads_total', outcome='ok')
+        log.log('guides_reloaded', path=self.path, version=flow.codec.version)
+        return True
+
+    def decode_state(self, encoded, flow):
+        """Decode a packed state written by flow or a recent guide layout"""
+        state = flow.codec.decode(encoded)
+        if state is not None:
+            return state
+        for codec in self._old_codecs:
+            state = codec.decode(encoded)
+            if state is not None:
+                flow.remap(state)
+                return state
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Validate or export guide content")
+    parser.add_argument('--export', metavar='PATH', help="write data.GUIDES to a JSON file")
+    parser.add_argument('--check', metavar='PATH', help="validate a guides file")
+    args = parser.parse_args(argv)
+
+    if args.export:
+        with open(args.export, 'w', encoding='utf-8') as f:
+            json.dump(GUIDES, f, indent=2, ensure_ascii=False)
+    if args.check:
+        Flow(load_guides(args.check))
+        print(f"{args.check}: OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# Replies to Telex A2A messages we have already handled.
+# Telex retries a delivery when our answer is slow or lost; replaying the
+# stored reply keeps a retried "yes" from advancing the conversation twice
+# and skips the handler entirely.
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+# Payloads without a message id are matched on their content, which a user
+# legitimately repeats ("yes", "yes"). Callers scope those keys to the
+# session state the reply produced, and they only cover a short retry window.
+ID_TTL = 600
+PAYLOAD_TTL = 5
+
+
+def request_key(data, session_id):
+    """Return (kind, key) identifying a Telex A2A request.
+
+    kind is 'id' when Telex sent a message id, else 'payload' with a hash of
+    the whole request body.
+    """
+    message = data.get('message')
+    message_id = data.get('messageId')
+    if message_id is None and isinstance(message, dict):
+        message_id = message.get('messageId', message.get('id'))
+    if message_id is not None:
+        return 'id', f"{session_id}:{message_id}"
+    digest = hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+    return 'payload', f"{session_id}:{digest}"
+
+
+class ReplyCache:
+    """Bounded cache of key -> (reply, resulting state) with per-entry expiry"""
+
+    def __init__(self, max_entries=20000, clock=time.monotonic):
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= self._clock():
+                del self._entries[key]
+                return None
+            return entry[1]
+
+    def put(self, key, value, ttl):
+        now = self._clock()
+        with self._lock:
+            self._entries[key] = (now + ttl, value)
+            self._entries.move_to_end(key)
+            # Oldest entries first: drop the expired ones, then over the cap
+            while self._entries:
+                oldest, (expires_at, _) = next(iter(self._entries.items()))
+                if expires_at > now and len(self._entries) <= self.max_entries:
+                    break
+                del self._entries[oldest]
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,70 @@
+# Keyword-based intent matching for the conversation handlers.
+# Every keyword table is compiled once into a single regex so a message is
+# scanned in one pass instead of one `any(...)` loop per intent.
+
+import re
+
+# Navigation intents, listed in priority order: when a message contains
+# keywords for several intents the one listed first wins.
+BACK_KEYWORDS = ['back', 'previous']
+YES_KEYWORDS = ['yes', 'ready', 'done', 'ok', 'okay', 'continue', 'completed']
+HELP_KEYWORDS = ['no', 'help', 'not sure', "can't"]
+
+SIGNUP_INTENTS = [
+    ('back', BACK_KEYWORDS),
+    ('restart', ['restart', 'start over']),
+    ('yes', YES_KEYWORDS),
+    ('help', HELP_KEYWORDS + ['problem']),
+]
+
+SERVICE_STEP_INTENTS = [
+    ('back', BACK_KEYWORDS),
+    ('restart', ['restart', 'start over', 'different service']),
+    ('yes', YES_KEYWORDS),
+    ('help', HELP_KEYWORDS),
+]
+
+
+class IntentMatcher:
+    """Match a message against an ordered table of (intent, keywords)"""
+
+    def __init__(self, table):
+        self.intents = [intent for intent, _ in table]
+        self._rank = {}
+        for rank, (intent, keywords) in enumerate(table):
+            for keyword in keywords:
+                # The first intent to claim a keyword keeps it
+                self._rank.setdefault(keyword, rank)
+
+        # Longest keywords first so "new address" wins over "new" when both
+        # start at the same position
+        keywords = sorted(self._rank, key=len, reverse=True)
+        self._pattern = re.compile(
+            r"(?<!\w)(?:" + "|".join(re.escape(k) for k in keywords) + r")(?!\w)"
+        )
+
+    def match_index(self, message):
+        """Return the index of the highest-priority intent found, or -1"""
+        best = -1
+        for found in self._pattern.finditer(message):
+            rank = self._rank[found.group(0)]
+            if best == -1 or rank < best:
+                best = rank
+                if rank == 0:
+                    break
+        return best
+
+    def match(self, message):
+        """Return the highest-priority intent found in the message, or None"""
+        index = self.match_index(message)
+        return None if index == -1 else self.intents[index]
+
+
+def build_service_matcher(guides):
+    """Build the service matcher from the 'keywords' of each guide"""
+    return IntentMatcher([
+        (process, guide['keywords'])
+        for process, guide in guides.items()
+        if guide.get('keywords')
+    ])
+
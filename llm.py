@@ -0,0 +1,252 @@
+# Optional LLM answers for off-script questions.
+# Only messages that match no intent inside a guide reach the LLM, and the
+# current step is always repeated after the answer. Calls go through one
+# pooled httpx client with strict timeouts, a concurrency limit and a circuit
+# breaker, and run on a small thread pool so a request waits at most
+# `deadline` seconds in total. Any failure or a late answer just leaves the
+# scripted reply as it was; a late answer is still cached for next time.
+#
+#   python llm.py --stub 8001   # OpenAI-compatible stub for local testing
+#   LLM_FALLBACK=1 OPENAI_BASE_URL=http://127.0.0.1:8001/v1 python app.py
+
+import argparse
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from logs import log
+from metrics import metrics
+from per_process import PerProcess
+from replies import make_reply
+
+SYSTEM_PROMPT = (
+    "You are the INEC CVR Assistant helping Nigerians use the Continuous Voter "
+    "Registration portal. Answer the user's question in at most three short "
+    "sentences. If you are not sure, tell them to contact their nearest INEC office."
+)
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+
+
+def normalize_question(text):
+    """Collapse case, punctuation and spacing so rephrasings share a cache entry"""
+    return " ".join(_PUNCTUATION.sub(" ", text.lower().replace("'", "")).split())
+
+
+class CircuitBreaker:
+    """Open after `threshold` consecutive failures, retry after `cooldown` seconds"""
+
+    def __init__(self, threshold=5, cooldown=30.0, clock=time.monotonic):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self._clock() - self.opened_at >= self.cooldown:
+                # Half-open: let one call through to probe the upstream
+                self.opened_at = self._clock()
+                return True
+            return False
+
+    def record(self, ok):
+        with self._lock:
+            if ok:
+                self.failures = 0
+                self.opened_at = None
+            else:
+                self.failures += 1
+                if self.failures >= self.threshold:
+                    self.opened_at = self._clock()
+
+
+class _Call:
+    """A single upstream request shared by everyone asking the same question"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.answer = None
+
+
+class LLMFallback:
+    """Answers off-script questions through an OpenAI-compatible chat API"""
+
+    def __init__(self, base_url, api_key, model, timeout=3.0, deadline=None, max_concurrency=8,
+                 cache_size=2048, cache_ttl=3600.0, breaker=None):
+        import httpx
+
+        self.model = model
+        self.timeout = timeout
+        # httpx applies timeout per connect/read/write; this bounds the total
+        self.deadline = timeout if deadline is None else deadline
+        self.max_concurrency = max_concurrency
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.breaker = breaker or CircuitBreaker()
+        self.client = httpx.Client(
+            base_url=base_url.rstrip('/'),
+            headers={"Authorization": f"Bearer {api_key}"} if api_key else {},
+            timeout=httpx.Timeout(timeout, connect=min(timeout, 1.0)),
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+        )
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # key -> (expires_at, answer)
+        self._in_flight = {}         # key -> _Call
+        self._pool = PerProcess(lambda: ThreadPoolExecutor(max_concurrency, thread_name_prefix='llm'))
+
+    def answer(self, question, guide, step):
+        """Return an answer for question asked during step of guide, or None
+        if there is none within the deadline"""
+        executor = self._pool.get()
+        key = (guide['title'], normalize_question(question))
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached and cached[0] > now:
+                self._cache.move_to_end(key)
+                metrics.count('llm_requests_total', outcome='cached')
+                return cached[1]
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = self._in_flight[key] = _Call()
+
+        if leader:
+            # A slot per queued call, so a stalled upstream can't build a backlog
+            if not self._slots.acquire(blocking=False):
+                metrics.count('llm_requests_total', outcome='saturated')
+                self._finish(key, call)
+                return None
+            executor.submit(self._resolve, key, call, question, guide, step)
+        else:
+            # Someone is already asking this: wait for their answer
+            metrics.count('llm_requests_total', outcome='coalesced')
+        if not call.done.wait(self.deadline):
+            metrics.count('llm_requests_total', outcome='deadline')
+            return None
+        return call.answer
+
+    def _resolve(self, key, call, question, guide, step):
+        try:
+            try:
+                call.answer = self._fetch(question, guide, step)
+            finally:
+                self._slots.release()
+            if call.answer is not None:
+                with self._lock:
+                    self._cache[key] = (time.monotonic() + self.cache_ttl, call.answer)
+                    self._cache.move_to_end(key)
+                    while len(self._cache) > self.cache_size:
+                        self._cache.popitem(last=False)
+        finally:
+            self._finish(key, call)
+
+    def _finish(self, key, call):
+        with self._lock:
+            del self._in_flight[key]
+        call.done.set()
+
+    def _fetch(self, question, guide, step):
+        if not self.breaker.allow():
+            metrics.count('llm_requests_total', outcome='circuit_open')
+            return None
+        started = time.perf_counter()
+        try:
+            response = self.client.post("/chat/completions", json={
+                "model": self.model,
+                "max_tokens": 200,
+                "messages": [
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": (
+                        f"I'm following the '{guide['title']}' on the INEC CVR portal, "
+                        f"currently at: {step['instruction']}\n\n{question}"
+                    )},
+                ],
+            })
+            response.raise_for_status()
+            answer = response.json()["choices"][0]["message"]["content"].strip()
+        except Exception as e:
+            self.breaker.record(False)
+            metrics.count('llm_requests_total', outcome='error')
+            log.log('llm_error', level='error', error=repr(e))
+            return None
+        finally:
+            metrics.observe('llm_request_seconds', time.perf_counter() - started)
+        self.breaker.record(True)
+        metrics.count('llm_requests_total', outcome='ok')
+        return answer or None
+
+    def augment(self, guide, step_index, message, reply):
+        """Flow fallback hook: prefix the repeated step with an answer"""
+        if len(message.split()) < 3:
+            return reply
+        answer = self.answer(message, guide, guide['steps'][step_index])
+        if answer is None:
+            return reply
+        return make_reply(f"{answer}\n\n{reply.text}")
+
+
+def create_fallback():
+    """Build the fallback from the environment, or None unless LLM_FALLBACK=1"""
+    if os.getenv("LLM_FALLBACK") != "1":
+        return None
+    return LLMFallback(
+        os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1"),
+        os.getenv("OPENAI_API_KEY"),
+        os.getenv("LLM_MODEL", "gpt-4o-mini"),
+        timeout=float(os.getenv("LLM_TIMEOUT", 3.0)),
+        deadline=float(os.getenv("LLM_DEADLINE", os.getenv("LLM_TIMEOUT", 3.0))),
+        max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", 8)),
+        cache_ttl=float(os.getenv("LLM_CACHE_TTL", 3600)),
+    )
+
+
+def run_stub(port, delay=0.0, fail_rate=0.0):
+    """Serve canned chat completions on localhost, optionally slow or failing"""
+    import random
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            time.sleep(delay)
+            if random.random() < fail_rate:
+                self.send_response(503)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            question = body["messages"][-1]["content"].splitlines()[-1]
+            payload = json.dumps({"choices": [{"message": {
+                "role": "assistant", "content": f"(stub answer) You asked: {question}"
+            }}]}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    ThreadingHTTPServer(('127.0.0.1', port), StubHandler).serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub server for testing the LLM fallback")
+    parser.add_argument('--stub', type=int, metavar='PORT', required=True)
+    parser.add_argument('--delay', type=float, default=0.0, help="seconds to wait before answering")
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="fraction of requests answered with 503")
+    args = parser.parse_args()
+    run_stub(args.stub, args.delay, args.fail_rate)
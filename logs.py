@@ -0,0 +1,114 @@
+# Non-blocking structured logging.
+# Request threads only put a record on a bounded queue; a background thread
+# serializes records to JSON lines and writes them to the stream in batches.
+
+import atexit
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+from per_process import PerProcess
+
+
+class AsyncLogWriter:
+    """Queue-backed JSON line writer that never blocks the caller.
+
+    When the queue is full new records are dropped and counted. Records
+    logged with sample=True (full request payloads) are kept at sample_rate,
+    and every payload is truncated to max_payload characters.
+    """
+
+    def __init__(self, stream=None, max_queue=10000, batch_size=256, flush_interval=0.5,
+                 max_payload=512, sample_rate=1.0):
+        self.stream = stream
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_payload = max_payload
+        self.sample_rate = sample_rate
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._worker = PerProcess(self._start_worker)
+        self.written = 0
+        self.dropped = 0
+        self.sampled_out = 0
+
+    def _start_worker(self):
+        worker = threading.Thread(target=self._run, name='log-writer', daemon=True)
+        worker.start()
+        return worker
+
+    def log(self, event, level='info', sample=False, **fields):
+        """Queue a record; returns immediately even if the writer is behind"""
+        if sample and self.sample_rate < 1 and random.random() >= self.sample_rate:
+            with self._lock:
+                self.sampled_out += 1
+            return
+        self._worker.get()
+        try:
+            self._queue.put_nowait((time.time(), level, event, fields))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def _format(self, record):
+        timestamp, level, event, fields = record
+        line = {'ts': round(timestamp, 3), 'level': level, 'event': event}
+        for key, value in fields.items():
+            if key == 'payload':
+                value = json.dumps(value, ensure_ascii=False, default=str)
+                if len(value) > self.max_payload:
+                    value = value[:self.max_payload] + '...'
+            line[key] = value
+        return json.dumps(line, ensure_ascii=False, default=str)
+
+    def _run(self):
+        while True:
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    def _write(self, batch):
+        stream = self.stream or sys.stdout
+        try:
+            stream.write("\n".join(self._format(record) for record in batch) + "\n")
+            stream.flush()
+            self.written += len(batch)
+        except Exception:
+            self.dropped += len(batch)
+
+    def flush(self, timeout=2.0):
+        """Wait up to timeout seconds for queued records to be written"""
+        if not self._worker.started():
+            return
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "sampled_out": self.sampled_out,
+        }
+
+
+log = AsyncLogWriter(
+    max_queue=int(os.getenv("LOG_QUEUE_SIZE", 10000)),
+    max_payload=int(os.getenv("LOG_MAX_PAYLOAD", 512)),
+    sample_rate=float(os.getenv("LOG_SAMPLE_RATE", 1.0)),
+)
+atexit.register(log.flush)
@@ -0,0 +1,163 @@
+# Low-overhead counters and latency histograms, exposed as Prometheus text.
+# Each thread writes to its own shard, so the hot path never takes a lock;
+# shards are only merged when /metrics is scraped.
+
+import bisect
+import functools
+import os
+import threading
+import time
+
+# Upper bounds in seconds for the latency histograms
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class _Shard:
+    __slots__ = ('thread', 'counters', 'histograms', 'calls')
+
+    def __init__(self, thread):
+        self.thread = thread
+        self.counters = {}    # (name, labels) -> count
+        self.histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+        self.calls = 0
+
+
+class Metrics:
+    """Per-thread counters and fixed-bucket histograms.
+
+    sample_rate controls how many timed calls are measured: 1 times every
+    call, 0.1 every tenth call per thread and 0 turns timing off so a timed
+    function costs one attribute check. Counters are always recorded.
+    """
+
+    def __init__(self, sample_rate=1.0, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.sample_every = round(1 / sample_rate) if sample_rate > 0 else 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+        self._retired = _Shard(None)
+        self._gauges = {}  # name -> (type, callable returning {labels: value})
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = _Shard(threading.current_thread())
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+
+    def count(self, name, amount=1, **labels):
+        counters = self._shard().counters
+        key = (name, tuple(sorted(labels.items())))
+        counters[key] = counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        histograms = self._shard().histograms
+        key = (name, tuple(sorted(labels.items())))
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = [0] * (len(self.buckets) + 2)
+        histogram[bisect.bisect_left(self.buckets, seconds)] += 1
+        histogram[-1] += seconds
+
+    def sampled(self):
+        """Return True if the current call should be timed"""
+        if not self.sample_every:
+            return False
+        shard = self._shard()
+        shard.calls += 1
+        return shard.calls % self.sample_every == 0
+
+    def timed(self, name, **labels):
+        """Decorator recording the wrapped function's latency in histogram name"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.sampled():
+                    return func(*args, **kwargs)
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(name, time.perf_counter() - started, **labels)
+            return wrapper
+        return decorator
+
+    def gauge(self, name, callback, kind='gauge'):
+        """Register callback() -> {label tuple: value}, read at scrape time.
+
+        kind='counter' exposes totals kept elsewhere, e.g. by a store.
+        """
+        self._gauges[name] = (kind, callback)
+
+    def _collect(self):
+        with self._lock:
+            # Fold shards of finished threads into one so thread-per-request
+            # servers don't grow the shard list forever
+            live = []
+            for shard in self._shards:
+                if shard.thread.is_alive():
+                    live.append(shard)
+                else:
+                    _merge(self._retired.counters, self._retired.histograms, shard)
+            self._shards = live
+            counters = dict(self._retired.counters)
+            histograms = {key: list(values) for key, values in self._retired.histograms.items()}
+        for shard in live:
+            _merge(counters, histograms, shard)
+        return counters, histograms
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format"""
+        counters, histograms = self._collect()
+        lines = []
+
+        for name in sorted({key[0] for key in counters}):
+            lines.append(f"# TYPE {name} counter")
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_labels(labels)} {value}")
+
+        for name in sorted({key[0] for key in histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (metric, labels), values in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, value in zip(self.buckets + ('+Inf',), values):
+                    cumulative += value
+                    le = bound if bound == '+Inf' else repr(bound)
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {values[-1]}")
+                lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+
+        for name, (kind, callback) in sorted(self._gauges.items()):
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(callback().items()):
+                lines.append(f"{name}{_labels(labels)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _merge(counters, histograms, shard):
+    for key, value in list(shard.counters.items()):
+        counters[key] = counters.get(key, 0) + value
+    for key, values in list(shard.histograms.items()):
+        total = histograms.get(key)
+        if total is None:
+            histograms[key] = list(values)
+        else:
+            for index, value in enumerate(values):
+                total[index] += value
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+metrics = Metrics(sample_rate=float(os.getenv("METRICS_SAMPLE_RATE", 1.0)))
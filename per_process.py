@@ -0,0 +1,29 @@
+# Resources that must be created once per process.
+# The app and its pipelines are built before a prefork server forks, but
+# threads and thread pools don't survive fork: each worker has to start its
+# own on first use.
+
+import os
+import threading
+
+
+class PerProcess:
+    """Value built by create() on first get() in each process"""
+
+    def __init__(self, create):
+        self._create = create
+        self._lock = threading.Lock()
+        self._pid = None
+        self._value = None
+
+    def get(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._value = self._create()
+                    self._pid = os.getpid()
+        return self._value
+
+    def started(self):
+        """Whether get() has built the value in this process"""
+        return self._pid == os.getpid()
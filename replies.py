@@ -0,0 +1,133 @@
+# Pre-rendered bot replies.
+# Every reply only depends on (process, step_index, variant), so the whole set
+# is rendered once from GUIDES at startup and handlers just index into it.
+# Prerequisite notices take the prerequisite's name in place of the step.
+
+import json
+from collections import namedtuple
+from types import MappingProxyType
+
+# text is the markdown reply, body the ready-to-send {"reply": text} JSON
+Reply = namedtuple('Reply', ['text', 'body'])
+
+DEFAULT_COMPLETION_NOTE = 'Your request has been submitted and will be processed by INEC.'
+
+
+def make_reply(text):
+    """Wrap reply text together with its serialized JSON body"""
+    return Reply(text, (json.dumps({"reply": text}) + "\n").encode())
+
+
+def render_step(process, step_index, steps):
+    """Render a step with its question and navigation hints"""
+    step = steps[step_index]
+    response = f"**Step {step['number']}:** {step['instruction']}"
+
+    if 'question' in step:
+        response += f"\n\n{step['question']}"
+
+    # Add navigation hints
+    nav_hints = []
+    if step_index > 0:
+        nav_hints.append("'back' for previous step")
+    if process != 'universal-signup':
+        nav_hints.append("'restart' for different service")
+
+    if nav_hints:
+        response += f"\n\n💡 *You can type {', '.join(nav_hints)}*"
+
+    return response
+
+
+def render_help(process, step_index, steps):
+    """Render the clarification shown when the user asks for help on a step"""
+    step = steps[step_index]
+    if process == 'universal-signup':
+        clarification = "No problem! Let me help you with this step:"
+    else:
+        clarification = "Let me help with this step:"
+    clarification += f"\n\n**Step {step['number']}:** {step['instruction']}"
+    if 'question' in step:
+        clarification += f"\n\n{step['question']}"
+    return clarification
+
+
+def render_completion(guide):
+    """Render the summary shown once every step of a service is done"""
+    documents = "\n".join('• ' + doc for doc in guide.get('required_documents', []))
+    return f"""🎉 **Excellent! You've completed all steps for {guide['title']}**
+
+**Required Documents:**
+{documents}
+
+**Important Note:**
+{guide.get('completion_note', DEFAULT_COMPLETION_NOTE)}
+
+Would you like to:
+• **Start over** with a new service
+• Get help with something **else**
+• **End** this conversation"""
+
+
+def render_prerequisite_notice(guide, prerequisite):
+    """Render the notice shown before redirecting a user to a prerequisite"""
+    name = prerequisite.get('short_title', prerequisite['title'])
+    return f"""
+🔍 **Important Notice**
+
+Before proceeding with **{guide['title']}**, INEC requires you to first complete the **{name}** process before making any changes.
+
+Let's start with that first:"""
+
+
+def render_service_menu(guides):
+    """Render one menu line per service, in guide order.
+
+    A guide's short_title and summary name it here, falling back to its
+    title and description.
+    """
+    lines = [
+        f"• **{guide.get('short_title', guide['title'])}** - {guide.get('summary', guide.get('description', ''))}"
+        for process, guide in guides.items() if process != 'universal-signup'
+    ]
+    return "\n" + "\n".join(lines) + "\n"
+
+
+def build_replies(guides, prerequisites):
+    """Render every possible reply into a read-only table.
+
+    prerequisites maps each process to every prerequisite it may be
+    detoured through, as returned by flow.check_prerequisites.
+    """
+    service_menu = render_service_menu(guides)
+    table = {
+        (None, None, 'empty'): "Please type a message so I can help you with INEC CVR services.",
+        (None, None, 'finished'): "You've completed all steps! 🎉",
+        ('service-selection', None, 'menu'): (
+            "\n🎉 **Great! You're now signed into the INEC CVR portal.**\n\n"
+            "**Which service would you like to proceed with?**\n"
+            + service_menu +
+            "\nJust tell me which service you need help with!"
+        ),
+        ('service-selection', None, 'retry'): (
+            "I'm not sure which service you need. Please choose one:\n"
+            + service_menu +
+            "\nWhich one would you like assistance with?"
+        ),
+        ('service-selection', None, 'restart'): (
+            "Okay, let's choose a different service. What would you like help with?"
+        ),
+    }
+
+    for process, guide in guides.items():
+        steps = guide['steps']
+        for step_index in range(len(steps)):
+            table[process, step_index, 'step'] = render_step(process, step_index, steps)
+            table[process, step_index, 'help'] = render_help(process, step_index, steps)
+        if process != 'universal-signup':
+            table[process, None, 'completion'] = render_completion(guide)
+            for prerequisite in prerequisites[process]:
+                table[process, prerequisite, 'notice'] = render_prerequisite_notice(guide, guides[prerequisite])
+
+    return MappingProxyType({key: make_reply(text) for key, text in table.items()})
+
@@ -0,0 +1,180 @@
+# Production entry point: the app under a prefork gunicorn server.
+# The app, its compiled guide Flow and the static assets are built once in
+# the master and frozen out of the garbage collector before the workers
+# fork, so workers start without rebuilding anything and keep sharing those
+# pages copy-on-write.
+#
+#   FLASK_SECRET_KEY=... WEB_WORKERS=4 WEB_THREADS=8 python server.py
+#   python server.py --bench-startup --workers 4
+
+import argparse
+import gc
+import hashlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from dotenv import load_dotenv
+
+
+def key_fingerprint(key):
+    """Short hash of a secret key, safe to log and compare between processes"""
+    if isinstance(key, str):
+        key = key.encode()
+    return hashlib.sha256(key).hexdigest()[:16]
+
+
+def server_options():
+    """gunicorn settings from the environment"""
+    threads = int(os.getenv("WEB_THREADS", 4))
+    return {
+        'bind': os.getenv("WEB_BIND", f"0.0.0.0:{os.getenv('PORT', 5000)}"),
+        'workers': int(os.getenv("WEB_WORKERS", 2 * (os.cpu_count() or 1) + 1)),
+        'threads': threads,
+        'worker_class': 'gthread' if threads > 1 else 'sync',
+        'timeout': int(os.getenv("WEB_TIMEOUT", 30)),
+        'keepalive': int(os.getenv("WEB_KEEPALIVE", 5)),
+        'max_requests': int(os.getenv("WEB_MAX_REQUESTS", 0)),
+        'max_requests_jitter': int(os.getenv("WEB_MAX_REQUESTS_JITTER", 0)),
+        'preload_app': os.getenv("WEB_PRELOAD", "1") == "1",
+        'post_worker_init': check_secret_key,
+    }
+
+
+def load_app():
+    """Build and preload the app, then freeze everything built so far.
+
+    Returns (app, seconds taken).
+    """
+    started = time.perf_counter()
+    from app import create_app, preload
+    app = preload(create_app())
+    # Frozen objects are skipped by later collections, so a worker's GC
+    # doesn't write to (and thereby copy) the pages they live on
+    gc.collect()
+    gc.freeze()
+    return app, time.perf_counter() - started
+
+
+def check_secret_key(worker):
+    """gunicorn post_worker_init hook: stop the server if this worker signs
+    cookies with a different key than the master expects"""
+    from gunicorn.arbiter import Arbiter
+
+    if key_fingerprint(worker.wsgi.secret_key) != os.environ["SECRET_KEY_FINGERPRINT"]:
+        worker.log.error("Worker %s has a different secret key than the master", worker.pid)
+        sys.exit(Arbiter.WORKER_BOOT_ERROR)
+
+
+def serve():
+    from gunicorn.app.base import BaseApplication
+
+    class Server(BaseApplication):
+        def __init__(self, options):
+            self.options = options
+            self.application = None
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            # Runs in the master with preload_app, in each worker otherwise
+            if self.application is None:
+                self.application, seconds = load_app()
+                print(f"App built in {seconds * 1000:.0f} ms (pid {os.getpid()})", file=sys.stderr)
+            return self.application
+
+    secret_key = os.getenv("FLASK_SECRET_KEY")
+    if not secret_key:
+        sys.exit("FLASK_SECRET_KEY must be set: every worker has to sign cookies with the same key")
+    os.environ["SECRET_KEY_FINGERPRINT"] = key_fingerprint(secret_key)
+    Server(server_options()).run()
+
+
+def private_dirty_kib():
+    """Memory this process no longer shares with its parent, or None off Linux"""
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Private_Dirty:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _worker_startup(app, forked_at, write_fd):
+    """Child side of the benchmark: serve a few requests, then report"""
+    client = app.test_client()
+    client.get("/")
+    client.post("/chat", json={"message": "hello"})
+    client.post("/telex/a2a", json={"sessionId": "bench", "message": {"text": "yes"}})
+    first_response = time.perf_counter() - forked_at
+    # A full collection is what eventually touches every tracked object
+    gc.collect()
+    os.write(write_fd, json.dumps([first_response, private_dirty_kib()]).encode())
+    os._exit(0)
+
+
+def fork_workers(app, workers):
+    """Fork workers like a prefork server; returns [(seconds to first response, KiB)]"""
+    children = []
+    for _ in range(workers):
+        read_fd, write_fd = os.pipe()
+        forked_at = time.perf_counter()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            _worker_startup(app, forked_at, write_fd)
+        os.close(write_fd)
+        children.append((pid, read_fd))
+
+    results = []
+    for pid, read_fd in children:
+        with os.fdopen(read_fd, 'rb') as f:
+            results.append(json.loads(f.read()))
+        os.waitpid(pid, 0)
+    return results
+
+
+def bench_startup(workers):
+    # Only one process here signs cookies; keep the missing-key warning out
+    os.environ.setdefault("FLASK_SECRET_KEY", "startup-benchmark")
+    # A worker without preloading imports and builds everything itself
+    cold = subprocess.run(
+        [sys.executable, "-c", "import server; print(server.load_app()[1])"],
+        capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    print(f"app build per worker without preload: {float(cold.stdout.split()[-1]) * 1000:.1f} ms")
+
+    app, seconds = load_app()
+    print(f"app build once in the master:         {seconds * 1000:.1f} ms")
+    print()
+    print(f"{'gc.freeze':<10} {'workers':>7} {'first response ms':>20} {'private dirty KiB':>20}")
+    for frozen in (True, False):
+        if not frozen:
+            gc.unfreeze()
+        results = fork_workers(app, workers)
+        first = [seconds * 1000 for seconds, _ in results]
+        private = [kib for _, kib in results if kib is not None]
+        print(f"{'yes' if frozen else 'no':<10} {workers:>7} "
+              f"{statistics.median(first):>11.1f} (max {max(first):.1f}) "
+              f"{statistics.median(private) if private else 'n/a':>20}")
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Run the app under a prefork gunicorn server")
+    parser.add_argument('--bench-startup', action='store_true',
+                        help="measure app build time and forked worker startup instead of serving")
+    parser.add_argument('--workers', type=int, default=4, help="workers to fork for --bench-startup")
+    args = parser.parse_args()
+    if args.bench_startup:
+        bench_startup(args.workers)
+    else:
+        serve()
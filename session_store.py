@@ -0,0 +1,148 @@
+# Server-side storage for Telex A2A conversations.
+# A2A callers are servers that usually don't send our cookie back, so their
+# conversation state is kept in-process, keyed by the Telex sessionId.
+#
+# Writes are compare-and-swap on ConversationState.version, so of two
+# requests that read the same version only the first to write succeeds.
+# Handlers hold lock(session_id) around read-dispatch-write; locks are
+# striped by session id, so unrelated sessions rarely share one.
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class StripedLocks:
+    """A fixed pool of locks shared out by key hash"""
+
+    def __init__(self, stripes=256):
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def __call__(self, key):
+        return self._locks[hash(key) % len(self._locks)]
+
+
+class SessionStore:
+    """Interface for a conversation state store keyed by session id"""
+
+    def get(self, session_id):
+        """Return a copy of the state for session_id, or None if it is
+        unknown or expired"""
+        raise NotImplementedError
+
+    def put(self, session_id, state):
+        """Store state if it is based on the stored version (version 0 for a
+        new session) and return True, else leave the store alone and return
+        False"""
+        raise NotImplementedError
+
+    def lock(self, session_id):
+        """Lock to hold while reading, updating and writing back a session"""
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        raise NotImplementedError
+
+    def __contains__(self, session_id):
+        """Whether session_id has a live state, without counting a hit or miss"""
+        raise NotImplementedError
+
+    def stats(self):
+        """Return counters describing how the store is being used"""
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    """In-process LRU store with idle expiry.
+
+    Entries are kept in least-recently-used order, so both the LRU victim and
+    the longest-idle entry sit at the front and every operation is O(1).
+    max_sessions caps memory use: a ConversationState is a small fixed-slot
+    object, so the cap bounds the store's size.
+    """
+
+    def __init__(self, max_sessions=10000, ttl=3600, clock=time.monotonic, lock_stripes=256):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()  # session_id -> (last_used, state)
+        self._lock = threading.Lock()  # only held for O(1) dict updates
+        self._session_locks = StripedLocks(lock_stripes)
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        self.conflicts = 0
+
+    def get(self, session_id):
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            if now - entry[0] > self.ttl:
+                del self._entries[session_id]
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._entries[session_id] = (now, entry[1])
+            self._entries.move_to_end(session_id)
+            self.hits += 1
+            return entry[1].copy()
+
+    def put(self, session_id, state):
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None and now - entry[0] > self.ttl:
+                entry = None
+            if state.version != (entry[1].version if entry is not None else 0):
+                self.conflicts += 1
+                return False
+            stored = state.copy()
+            stored.version += 1
+            state.version = stored.version
+            self._entries[session_id] = (now, stored)
+            self._entries.move_to_end(session_id)
+            self._evict(now)
+            return True
+
+    def lock(self, session_id):
+        return self._session_locks(session_id)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+    def __contains__(self, session_id):
+        entry = self._entries.get(session_id)
+        return entry is not None and self._clock() - entry[0] <= self.ttl
+
+    def _evict(self, now):
+        # Drop idle sessions from the front, then the least recently used
+        # ones until we are back under the cap
+        entries = self._entries
+        while entries:
+            session_id, (last_used, _) = next(iter(entries.items()))
+            if now - last_used > self.ttl:
+                self.expired += 1
+            elif len(entries) > self.max_sessions:
+                self.evicted += 1
+            else:
+                break
+            del entries[session_id]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {
+            "sessions": len(self._entries),
+            "max_sessions": self.max_sessions,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "conflicts": self.conflicts,
+        }
@@ -0,0 +1,115 @@
+# Conversation state shared by the web and Telex flows.
+
+import base64
+import struct
+import zlib
+
+
+class ConversationState:
+    """Where a user is in the guides: the current process and step, which
+    processes they have finished and the service waiting on revalidation.
+
+    version counts the writes of this state to a SessionStore; a write based
+    on an older version is refused (compare-and-swap).
+    """
+
+    __slots__ = ('current_process', 'current_step', 'completed_processes', 'pending_service', 'version')
+
+    def __init__(self, current_process='universal-signup', current_step=0,
+                 completed_processes=None, pending_service=None):
+        self.current_process = current_process
+        self.current_step = current_step
+        self.completed_processes = completed_processes if completed_processes is not None else []
+        self.pending_service = pending_service
+        self.version = 0
+
+    def reset(self):
+        """Start the conversation over from the first sign-up step"""
+        version = self.version
+        self.__init__()
+        self.version = version
+
+    def copy(self):
+        state = ConversationState(self.current_process, self.current_step,
+                                  list(self.completed_processes), self.pending_service)
+        state.version = self.version
+        return state
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a state from its dict form, or a fresh state if there is none"""
+        if not data:
+            return cls()
+        return cls(
+            data.get('current_process', 'universal-signup'),
+            data.get('current_step', 0),
+            list(data.get('completed_processes', [])),
+            data.get('pending_service'),
+        )
+
+    def to_dict(self):
+        return {
+            'current_process': self.current_process,
+            'current_step': self.current_step,
+            'completed_processes': list(self.completed_processes),
+            'pending_service': self.pending_service,
+        }
+
+
+class StateCodec:
+    """Pack a ConversationState into a few bytes for the /chat cookie.
+
+    Layout: version, process id, step, pending service id, completed mask.
+    Process ids follow GUIDES order starting at 1; 0 is service selection
+    (or no pending service) and completed processes are one bit each. The
+    version byte is derived from the guide layout, so cookies written
+    against a different set of guides decode as a fresh conversation.
+    """
+
+    FORMAT = 1
+    _layout = struct.Struct('>BBBBI')
+    # One bit of the completed mask per guide
+    MAX_GUIDES = 32
+
+    def __init__(self, guides):
+        self.guides = guides
+        self.processes = ['service-selection'] + list(guides)
+        self.process_ids = {process: index for index, process in enumerate(self.processes)}
+        layout = f"{self.FORMAT}:" + ",".join(
+            f"{process}/{len(guide['steps'])}" for process, guide in guides.items()
+        )
+        self.version = zlib.crc32(layout.encode()) & 0xff
+
+    def encode(self, state):
+        completed = 0
+        for process in state.completed_processes:
+            completed |= 1 << (self.process_ids[process] - 1)
+        packed = self._layout.pack(
+            self.version,
+            self.process_ids[state.current_process],
+            state.current_step,
+            self.process_ids[state.pending_service] if state.pending_service else 0,
+            completed,
+        )
+        return base64.urlsafe_b64encode(packed).rstrip(b'=').decode('ascii')
+
+    def decode(self, encoded):
+        """Return the decoded state, or None if it is malformed or outdated"""
+        try:
+            packed = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+            version, process_id, step, pending_id, completed = self._layout.unpack(packed)
+        except (ValueError, TypeError, struct.error):
+            return None
+        if version != self.version or process_id >= len(self.processes) or pending_id >= len(self.processes):
+            return None
+
+        process = self.processes[process_id]
+        if process != 'service-selection' and step >= len(self.guides[process]['steps']):
+            return None
+        return ConversationState(
+            process,
+            step,
+            [p for index, p in enumerate(self.processes[1:]) if completed >> index & 1],
+            self.processes[pending_id] if pending_id else None,
+        )
+
@@ -7,6 +7,183 @@ function handleKeyPress(event) {
   }
 }
 
+// Client-side step engine: once the guide bundle is loaded, back/yes/help/
+// restart and keyword service selection are answered right here. Anything
+// else goes to the server along with the local state, and the state reached
+// locally is synced back in batches so the server picks up where we left off.
+const SYNC_EVERY_TURNS = 5;
+const SYNC_INTERVAL_MS = 10000;
+let guideBundle = null;
+// Loading the page starts a new conversation (see home()), so the state is
+// unknown until the first server reply
+let chatState = null;
+let unsyncedTurns = 0;
+let syncTimer = null;
+// Turns answered locally since the last sync, for the server's funnel log
+let localTurns = [];
+
+function compileMatcher(table) {
+  // Same rules as intents.IntentMatcher: whole words, longest keyword first,
+  // the first intent listed wins
+  const intents = table.map(([intent]) => intent);
+  const rank = new Map();
+  table.forEach(([, keywords], index) => {
+    keywords.forEach((keyword) => { if (!rank.has(keyword)) rank.set(keyword, index); });
+  });
+  const escape = (text) => text.replace(/[.*+?^${}()|[\]\\]/g, "\\$&");
+  const keywords = [...rank.keys()].sort((a, b) => b.length - a.length);
+  const pattern = new RegExp(
+    "(?<![\\p{L}\\p{N}_])(?:" + keywords.map(escape).join("|") + ")(?![\\p{L}\\p{N}_])", "gu");
+
+  return (message) => {
+    let best = -1;
+    for (const found of message.matchAll(pattern)) {
+      const index = rank.get(found[0]);
+      if (best === -1 || index < best) best = index;
+      if (best === 0) break;
+    }
+    return best === -1 ? null : intents[best];
+  };
+}
+
+function useBundle(bundle) {
+  guideBundle = bundle;
+  guideBundle.matchSignup = compileMatcher(bundle.intents.signup);
+  guideBundle.matchStep = compileMatcher(bundle.intents.step);
+  guideBundle.matchService = compileMatcher(bundle.services);
+}
+
+async function loadGuideBundle() {
+  const cached = JSON.parse(localStorage.getItem("guideBundle") || "null");
+  try {
+    const manifest = await (await fetch("/guides/bundle", { cache: "no-cache" })).json();
+    if (cached && cached.version === manifest.version) {
+      useBundle(cached.bundle);
+      return;
+    }
+    const response = await fetch(manifest.url);
+    if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+    const bundle = await response.json();
+    localStorage.setItem("guideBundle", JSON.stringify({ version: manifest.version, bundle }));
+    useBundle(bundle);
+  } catch (error) {
+    // Offline: the last bundle we saw is still good for navigation
+    if (cached) useBundle(cached.bundle);
+  }
+}
+
+function missingPrerequisite(service, state) {
+  return guideBundle.guides[service].prerequisites.find(
+    (prerequisite) => !state.completed_processes.includes(prerequisite)) || null;
+}
+
+function markCompleted(state) {
+  if (!state.completed_processes.includes(state.current_process)) {
+    state.completed_processes.push(state.current_process);
+  }
+}
+
+// Mirrors flow.Flow.dispatch. Returns {text, intent} with the reply text and
+// the matched intent or service, or null when the message has to go to the
+// server (nothing matched, or unknown state).
+function dispatchLocally(state, message) {
+  const bundle = guideBundle;
+
+  if (state.current_process === bundle.selection) {
+    const service = bundle.matchService(message);
+    if (!service) return null;
+    const prerequisite = missingPrerequisite(service, state);
+    state.current_step = 0;
+    if (prerequisite) {
+      state.pending_service = service;
+      state.current_process = prerequisite;
+      return { text: bundle.guides[service].notices[prerequisite], intent: service };
+    }
+    state.current_process = service;
+    return { text: bundle.guides[service].steps[0], intent: service };
+  }
+
+  const guide = bundle.guides[state.current_process];
+  if (!guide || state.current_step >= guide.steps.length) return null;
+  const isEntry = state.current_process === bundle.entry;
+  const intent = (isEntry ? bundle.matchSignup : bundle.matchStep)(message);
+  const step = state.current_step;
+  const reply = (text) => ({ text, intent });
+
+  if (intent === "back") {
+    state.current_step = Math.max(step - 1, 0);
+    return reply(guide.steps[state.current_step]);
+  }
+  if (intent === "help") {
+    return reply(guide.help[step]);
+  }
+  if (intent === "restart") {
+    if (isEntry) {
+      state.current_step = 0;
+      return reply(guide.steps[0]);
+    }
+    state.pending_service = null;
+    state.current_process = bundle.selection;
+    state.current_step = 0;
+    return reply(bundle.replies.restart);
+  }
+  if (intent !== "yes") return null;
+
+  if (step < guide.steps.length - 1) {
+    state.current_step = step + 1;
+    return reply(guide.steps[step + 1]);
+  }
+  markCompleted(state);
+  state.current_step = 0;
+  if (state.pending_service) {
+    // Continue with the service that was waiting on this one
+    const pending = state.pending_service;
+    const next = missingPrerequisite(pending, state) || pending;
+    if (next === pending) state.pending_service = null;
+    state.current_process = next;
+    return reply(bundle.guides[next].steps[0]);
+  }
+  state.current_process = bundle.selection;
+  return reply(isEntry ? bundle.replies.menu : guide.completion);
+}
+
+function setChatState(state, synced) {
+  chatState = state;
+  if (synced) {
+    unsyncedTurns = 0;
+    clearTimeout(syncTimer);
+    syncTimer = null;
+    return;
+  }
+  unsyncedTurns += 1;
+  if (unsyncedTurns >= SYNC_EVERY_TURNS) {
+    syncChatState();
+  } else if (!syncTimer) {
+    syncTimer = setTimeout(syncChatState, SYNC_INTERVAL_MS);
+  }
+}
+
+function takeLocalTurns() {
+  // [from process, from step, to process, to step, intent, ms ago]
+  const now = Date.now();
+  const turns = localTurns.map((turn) => [...turn.slice(0, 5), now - turn[5]]);
+  localTurns = [];
+  return turns;
+}
+
+function syncChatState(beacon) {
+  if (!unsyncedTurns || !chatState) return;
+  const body = JSON.stringify({ state: chatState, turns: takeLocalTurns() });
+  unsyncedTurns = 0;
+  clearTimeout(syncTimer);
+  syncTimer = null;
+  if (beacon && navigator.sendBeacon) {
+    navigator.sendBeacon("/chat/sync", new Blob([body], { type: "application/json" }));
+  } else {
+    fetch("/chat/sync", { method: "POST", headers: { "Content-Type": "application/json" }, body, keepalive: true });
+  }
+}
+
 async function sendMessage() {
   const input = document.getElementById("user-input");
   const chatBox = document.getElementById("chat-box");
@@ -16,17 +193,34 @@ async function sendMessage() {
 
   input.value = "";
   addMessageToChat(chatBox, userMessage, 'user-msg');
+
+  if (guideBundle && chatState) {
+    const state = structuredClone(chatState);
+    const localReply = dispatchLocally(state, userMessage.toLowerCase());
+    if (localReply !== null) {
+      localTurns.push([chatState.current_process, chatState.current_step,
+                       state.current_process, state.current_step, localReply.intent, Date.now()]);
+      setChatState(state, false);
+      addMessageToChat(chatBox, localReply.text, 'bot-msg');
+      return;
+    }
+  }
   
   let loadingId = null;
   
   try {
     // Show loading indicator
     loadingId = showLoadingMessage(chatBox);
-    
+
+    // With the guide bundle, hand over to the server with our state
+    // (null: use the cookie's)
+    const body = guideBundle
+      ? { message: userMessage, state: chatState, turns: takeLocalTurns() }
+      : { message: userMessage };
     const response = await fetch("/chat", {
       method: "POST",
       headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ message: userMessage })
+      body: JSON.stringify(body)
     });
 
     if (!response.ok) {
@@ -35,6 +229,7 @@ async function sendMessage() {
 
     const data = await response.json();
     const aiReply = data.reply;
+    if (data.state) setChatState(data.state, true);
 
     // Remove loading FIRST
     removeLoadingMessage(loadingId);
@@ -66,6 +261,7 @@ function addMessageToChat(chatBox, message, className) {
   messageDiv.textContent = message;
   chatBox.appendChild(messageDiv);
   chatBox.scrollTop = chatBox.scrollHeight;
+  return messageDiv;
 }
 
 function showLoadingMessage(chatBox) {
@@ -96,7 +292,14 @@ function addRestartButton() {
 
 async function restartConversation() {
     await fetch("/reset", { method: "POST" });
+    if (chatState) {
+      setChatState({ current_process: "universal-signup", current_step: 0,
+                     completed_processes: [], pending_service: null }, true);
+    }
     document.getElementById("chat-box").innerHTML = '';
     addMessageToChat(document.getElementById("chat-box"), 
         "Hello! I'm your INEC CVR Assistant. How can I help you with voter registration today?", 'bot-msg');
-}
\ No newline at end of file
+}
+
+loadGuideBundle();
+window.addEventListener("pagehide", () => syncChatState(true));
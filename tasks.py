@@ -0,0 +1,231 @@
+# Asynchronous Telex A2A tasks.
+# In async mode /telex/a2a only queues the message and answers 202 with a
+# task id. A bounded thread pool runs the handler, keeping each session's
+# messages in order, and the results are pushed to a callback URL in
+# batches, in the same order, over one pooled keep-alive client.
+#
+#   python tasks.py --stub 8002   # callback receiver for local testing
+#   TELEX_A2A_MODE=async TELEX_CALLBACK_URL=http://127.0.0.1:8002/results python app.py
+
+import argparse
+import functools
+import json
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from logs import log
+from metrics import metrics
+from per_process import PerProcess
+
+
+class SessionTaskRunner:
+    """Bounded thread pool that runs tasks for one key in submission order
+    and tasks for different keys in parallel"""
+
+    def __init__(self, max_workers=8, max_pending=1000, name='session-task'):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.name = name
+        self.pending = 0
+        self._queues = {}  # key -> deque of tasks, the first one running
+        self._lock = threading.Lock()
+        self._pool = PerProcess(lambda: ThreadPoolExecutor(max_workers, thread_name_prefix=name))
+
+    def submit(self, key, task):
+        """Queue task() behind earlier tasks for key; returns False if full"""
+        executor = self._pool.get()
+        with self._lock:
+            if self.pending >= self.max_pending:
+                return False
+            self.pending += 1
+            tasks = self._queues.get(key)
+            if tasks is not None:
+                # A worker is already draining this key
+                tasks.append(task)
+                return True
+            self._queues[key] = deque([task])
+        executor.submit(self._drain, key)
+        return True
+
+    def _drain(self, key):
+        while True:
+            with self._lock:
+                task = self._queues[key][0]
+            try:
+                task()
+            except Exception as e:
+                log.log('session_task_error', level='error', error=repr(e))
+            with self._lock:
+                tasks = self._queues[key]
+                tasks.popleft()
+                self.pending -= 1
+                if not tasks:
+                    del self._queues[key]
+                    return
+
+
+class BatchRunner:
+    """Runs a batch of items grouped by key: items sharing a key one after
+    the other in batch order, different keys in parallel on a bounded pool"""
+
+    def __init__(self, max_workers=8):
+        self.max_workers = max_workers
+        self._pool = PerProcess(lambda: ThreadPoolExecutor(max_workers, thread_name_prefix='batch'))
+
+    def run(self, items, key, handle):
+        """Yield handle(index, item) for every item, a whole key group at a
+        time as each group finishes"""
+        groups = {}
+        for index, item in enumerate(items):
+            groups.setdefault(key(item), []).append((index, item))
+        executor = self._pool.get()
+        futures = [executor.submit(self._run_group, group, handle) for group in groups.values()]
+        for future in as_completed(futures):
+            yield from future.result()
+
+    @staticmethod
+    def _run_group(group, handle):
+        return [handle(index, item) for index, item in group]
+
+
+class CallbackSender:
+    """Pushes results to callback URLs in batches per destination.
+
+    A batch goes out once it holds max_batch results or its oldest result
+    has waited batch_interval seconds. Failed posts are retried with
+    exponential backoff; 4xx answers other than 429 are not retried.
+    Batches for one URL are posted one at a time, in order, so a session's
+    results arrive in the order its messages were handled.
+    """
+
+    def __init__(self, max_batch=50, batch_interval=0.2, retries=4, backoff=0.5,
+                 timeout=5.0, max_connections=8, max_queue=10000, headers=None):
+        self.max_batch = max_batch
+        self.batch_interval = batch_interval
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.headers = headers or {}
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._worker = PerProcess(self._start_worker)
+        self._client = None
+        self._posters = None
+
+    def _start_worker(self):
+        import httpx
+
+        self._client = httpx.Client(
+            timeout=httpx.Timeout(self.timeout, connect=min(self.timeout, 2.0)),
+            limits=httpx.Limits(max_connections=self.max_connections,
+                                max_keepalive_connections=self.max_connections),
+            headers=self.headers,
+        )
+        self._posters = SessionTaskRunner(self.max_connections, self._queue.maxsize, 'callback-post')
+        worker = threading.Thread(target=self._run, name='callback-batch', daemon=True)
+        worker.start()
+        return worker
+
+    def send(self, url, result):
+        """Queue a result for url; returns False if the queue is full"""
+        self._worker.get()
+        try:
+            self._queue.put_nowait((url, result))
+        except queue.Full:
+            metrics.count('telex_callbacks_total', outcome='dropped')
+            return False
+        return True
+
+    def queued(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        batches = {}  # url -> (first queued at, [results])
+        while True:
+            timeout = None
+            if batches:
+                oldest = min(started for started, _ in batches.values())
+                timeout = max(0.0, oldest + self.batch_interval - time.monotonic())
+            try:
+                url, result = self._queue.get(timeout=timeout)
+                batch = batches.setdefault(url, (time.monotonic(), []))[1]
+                batch.append(result)
+            except queue.Empty:
+                pass
+            now = time.monotonic()
+            for url, (started, results) in list(batches.items()):
+                if len(results) >= self.max_batch or now - started >= self.batch_interval:
+                    del batches[url]
+                    if not self._posters.submit(url, functools.partial(self._post, url, results)):
+                        metrics.count('telex_callbacks_total', amount=len(results), outcome='dropped')
+
+    def _post(self, url, results):
+        for attempt in range(self.retries + 1):
+            try:
+                response = self._client.post(url, json={"results": results})
+                if response.status_code < 300:
+                    metrics.count('telex_callbacks_total', amount=len(results), outcome='delivered')
+                    metrics.count('telex_callback_batches_total', outcome='delivered')
+                    return True
+                if 400 <= response.status_code < 500 and response.status_code != 429:
+                    break
+                error = f"HTTP {response.status_code}"
+            except Exception as e:
+                error = repr(e)
+            if attempt < self.retries:
+                metrics.count('telex_callback_batches_total', outcome='retried')
+                # Full jitter keeps many workers from retrying in lockstep
+                time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+        metrics.count('telex_callbacks_total', amount=len(results), outcome='dropped')
+        metrics.count('telex_callback_batches_total', outcome='failed')
+        log.log('telex_callback_error', level='error', url=url, results=len(results), error=error)
+        return False
+
+
+def create_callback_sender():
+    return CallbackSender(
+        max_batch=int(os.getenv("TELEX_CALLBACK_BATCH", 50)),
+        batch_interval=float(os.getenv("TELEX_CALLBACK_BATCH_INTERVAL", 0.2)),
+        retries=int(os.getenv("TELEX_CALLBACK_RETRIES", 4)),
+        backoff=float(os.getenv("TELEX_CALLBACK_BACKOFF", 0.5)),
+        timeout=float(os.getenv("TELEX_CALLBACK_TIMEOUT", 5.0)),
+        max_connections=int(os.getenv("TELEX_CALLBACK_CONNECTIONS", 8)),
+        headers={"Authorization": f"Bearer {os.getenv('TELEX_CALLBACK_TOKEN')}"}
+        if os.getenv("TELEX_CALLBACK_TOKEN") else None,
+    )
+
+
+def run_stub(port, fail_rate=0.0):
+    """Receive callback batches on localhost and print each result"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            status = 503 if random.random() < fail_rate else 204
+            if status == 204:
+                for result in body["results"]:
+                    print(json.dumps(result), flush=True)
+            self.send_response(status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    ThreadingHTTPServer(('127.0.0.1', port), StubHandler).serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Callback receiver stub for async Telex A2A tasks")
+    parser.add_argument('--stub', type=int, metavar='PORT', required=True)
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="fraction of batches answered with 503")
+    args = parser.parse_args()
+    run_stub(args.stub, args.fail_rate)